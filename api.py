@@ -1,12 +1,150 @@
 from aiohttp import web
-import asyncio, aiohttp, time, random, string
+import asyncio, aiohttp, time, random, string, json, hashlib, functools, zlib, math
+from typing import Tuple, Optional
+from plugins.webshop.shopManager import EconomyUserCache, MemberShopContext
 
 routes = web.RouteTableDef()
 
+# This is the maximum amount of items that can be purchased in a single cart request.
+__MAX_CART_ITEMS__ = 50
+
+# These are the default and maximum amount of items returned in a single page of search results.
+__DEFAULT_SEARCH_LIMIT__ = 20
+__MAX_SEARCH_LIMIT__ = 100
+
+# This is the zlib compression level used for responses, from 1 (fastest) to 9 (smallest).
+__COMPRESSION_LEVEL__ = 6
+
+# Records the time taken and the response status of every request to the decorated route in the
+# shop metrics. Requests that raise an exception are recorded with the 'error' status.
+def _instrumented(route: str):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            shopManager = request.app["bot"].utils.managers.shopManager
+            started = time.perf_counter(); status = "error"
+            try:
+                response = await handler(request)
+                status = str(response.status)
+                return response
+
+            finally:
+                shopManager._requestSeconds.observe(time.perf_counter() - started, route)
+                shopManager._requests.inc(route, status)
+        return wrapper
+    return decorator
+
+# Rate limits the decorated route by its global rate limit, and then by the request code it is given and
+# the member it belongs to. This is checked before the route does anything else, so a rate limited request
+# costs almost nothing.
+def _rate_limited(route: str):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            shopManager = request.app["bot"].utils.managers.shopManager
+            retryAfter = shopManager.checkGlobalRateLimit(route)
+            if retryAfter > 0: return _too_many_requests(retryAfter)
+
+            # Unknown request codes are not given a bucket of their own, so they cannot be used to fill
+            # the rate limiter. The route rejects them cheaply anyway. Routes given a user ID instead
+            # check the members limit themselves, once they know the member is real.
+            request_code = request.match_info.get("request_id")
+            member_id = None if request_code is None else shopManager.getMemberIDFromRequestCode(request_code)
+            if member_id is not None:
+                retryAfter = shopManager.checkRateLimit(route, request_code, member_id)
+                if retryAfter > 0: return _too_many_requests(retryAfter)
+
+            return await handler(request)
+        return wrapper
+    return decorator
+
+def _too_many_requests(retry_after: float):
+    return web.json_response({"success": False, "error_message": "Too many requests, please try again later.", "status_code": 429}, status=429, content_type='application/json', headers={"Retry-After": str(math.ceil(retry_after))})
+
+# Compresses the body of the response returned by the decorated route with gzip, if the client accepts
+# it and the body is at least the compression threshold in bytes. Setting the threshold to None in the
+# config disables compression.
+def _compressed(handler):
+    @functools.wraps(handler)
+    async def wrapper(request):
+        response = await handler(request)
+        threshold = request.app["bot"].config.json["plugins"]["webshop"].get("compression_threshold", 1024)
+        if threshold is None or not isinstance(response.body, bytes) or len(response.body) < threshold: return response
+        if "Content-Encoding" in response.headers or not _accepts_gzip(request): return response
+
+        compressor = zlib.compressobj(__COMPRESSION_LEVEL__, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        response.body = compressor.compress(response.body) + compressor.flush()
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+    return wrapper
+
+# Checks if the Accept-Encoding header of the request allows gzip, which it does unless it is missing
+# or given a quality of zero.
+def _accepts_gzip(request) -> bool:
+    for encoding in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, parameters = encoding.partition(";")
+        if name.strip().lower() not in ["gzip", "*"]: continue
+        return parameters.replace(" ", "").lower() not in ["q=0", "q=0.0", "q=0.00", "q=0.000"]
+    return False
+
+# Checks if the If-None-Match header of the request contains the given ETag, meaning the client
+# already has the current version of the response. ETags are compared weakly, as the response
+# may have been compressed.
+def _matches_etag(request, etag: str) -> bool:
+    ifNoneMatch = request.headers.get("If-None-Match")
+    if ifNoneMatch is None: return False
+    if ifNoneMatch.strip() == "*": return True
+    return _opaque_tag(etag) in [_opaque_tag(tag) for tag in ifNoneMatch.split(",")]
+
+def _opaque_tag(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+# Builds the context used for the view data of the given member_id. The economyUser cache of the
+# request can be given, so an economyUser already fetched is reused. If the economyManager cannot find
+# the member then None is returned.
+async def _get_view_context(bot, member_id: int, economy_users: Optional[EconomyUserCache] = None) -> Optional[MemberShopContext]:
+    if economy_users is None: economy_users = EconomyUserCache(bot)
+
+    # The economyUser is fetched in the background while the catalog is serialized (if it has changed)
+    # and the members state is read, rather than waiting for it before doing anything else. The balance
+    # is given to the context so that items with a minimum balance can be checked.
+    await economy_users.startFetch(member_id)
+    bot.utils.managers.shopManager.getCatalogJSON()
+    context = bot.utils.managers.shopManager.getMemberContext(member_id, economy_users)
+    economyUser = await economy_users.getUser(member_id)
+    if economyUser is None: return None
+
+    context.balance = int(economyUser)
+    return context
+
+# This is the response given when the economyManager cannot find the member of a request.
+def _unknown_member():
+    return web.json_response({"success": False, "error_message": "Failed to find member in Discord Server.", "status_code": 401}, status=200, content_type='application/json')
+
+# Builds the view data for the member of the context as JSON, along with an ETag for it. The catalog is
+# already serialized so we only need to serialize the members overlay and then join the two JSON objects.
+# If the ETag was already worked out by the shopManager it can be given, otherwise it is made from the data.
+def _get_view_data(bot, context: MemberShopContext, etag: Optional[str] = None) -> Tuple[bytes, str]:
+    catalogJSON, catalogETag = bot.utils.managers.shopManager.getCatalogJSON()
+
+    overlay = {"user": {"balance": context.balance}}
+    overlay.update(bot.utils.managers.shopManager.getMemberOverlay(context.member_id, context))
+    overlayJSON = json.dumps(overlay, separators=(",", ":")).encode()
+
+    # The ETag changes whenever either the catalog or the members overlay changes.
+    if etag is None: etag = 'W/"' + catalogETag + "-" + hashlib.blake2b(overlayJSON, digest_size=8).hexdigest() + '"'
+    return catalogJSON[:-1] + b"," + overlayJSON[1:], etag
+
 @routes.get('/plugins/webshop')
+@_compressed
 async def get_root(request): return web.json_response({"success": False, "error_message": "Root access to webshop is prohibited."}, status=200, content_type='application/json')
 
 @routes.get('/plugins/webshop/view/{request_id}')
+@_instrumented("view")
+@_rate_limited("view")
+@_compressed
 async def get_info(request):
 
     bot = request.app["bot"]
@@ -16,22 +154,25 @@ async def get_info(request):
     member_id = bot.utils.managers.shopManager.getMemberIDFromRequestCode(request_id)
     if member_id is None: return web.json_response({"success": False, "error_message": "Unknown identification code.", "status_code": 401}, status=200, content_type='application/json')
 
-    # Once we have the member ID, construct the response data.
-    economyUser = await bot.utils.managers.economyManager.getUser(member_id)
-
-    data = {
-        "title": bot.config.json["plugins"]["webshop"]["web_title"],
-        "currency_symbol": bot.config.json["plugins"]["webshop"]["web_currency_symbol"],
-        "description": bot.config.json["plugins"]["webshop"]["web_description"],
-        "user": {
-            "balance": int(economyUser)
-        },
-        "categories": bot.utils.managers.shopManager.getCategoriesForMemberID(member_id),
-        "category_subtitles": bot.utils.managers.shopManager._categorySubtitles
-    }
-    return web.json_response({"success": True, "data": data}, status=200, content_type='application/json')
+    # Once we have the member ID, construct the response data. If the website already has the
+    # same response we can skip sending the body again. Where possible this is known from the
+    # shopManager versions alone, so the view does not have to be built at all.
+    context = await _get_view_context(bot, member_id)
+    if context is None: return _unknown_member()
+
+    etag = bot.utils.managers.shopManager.getViewETag(context)
+    if etag is not None and _matches_etag(request, etag): return web.Response(status=304, headers={"ETag": etag})
+
+    data, etag = _get_view_data(bot, context, etag)
+    if _matches_etag(request, etag): return web.Response(status=304, headers={"ETag": etag})
+
+    body = b'{"success":true,"data":' + data + b"}"
+    return web.Response(body=body, status=200, content_type='application/json', headers={"ETag": etag})
 
 @routes.get('/plugins/webshop/purchase/{request_id}/{item_id}')
+@_instrumented("purchase")
+@_rate_limited("purchase")
+@_compressed
 async def get_purchase(request):
 
     bot = request.app["bot"]
@@ -48,17 +189,114 @@ async def get_purchase(request):
 
     # Now that we have the member_id and the item, we should actually
     # execute the purchase request and get its output.
-    success, reason = await item.purchase(member_id)
+    success, reason = await item.purchase(member_id, EconomyUserCache(bot))
     
     # Now we return the response from the item purchase request and allow for the website
     # to handle the rest.
     return web.json_response({"success": True, "purchase": {"success": success, "reason": reason, "item": item.getData(member_id)}}, status=200, content_type='application/json')
 
 
+# This route searches the shop for the member, returning a single page of matching items so the website does
+# not need the whole catalog. The query arguments are all optional:
+#   category            Only items in the given category.
+#   min_price/max_price Only items within the price range.
+#   q                   Only items with every word in their title or description.
+#   affordable          If 'true', only items the member can afford.
+#   available           If 'true', only items the member can currently purchase.
+#   limit               The amount of items in the page (up to __MAX_SEARCH_LIMIT__).
+#   cursor              The next_cursor returned with the previous page.
+@routes.get('/plugins/webshop/search/{request_id}')
+@_instrumented("search")
+@_rate_limited("search")
+@_compressed
+async def get_search(request):
+
+    bot = request.app["bot"]
+    request_id = request.match_info["request_id"]
+
+    # Attempt to get the member ID from the request.
+    member_id = bot.utils.managers.shopManager.getMemberIDFromRequestCode(request_id)
+    if member_id is None: return web.json_response({"success": False, "error_message": "Unknown identification code.", "status_code": 401}, status=200, content_type='application/json')
+
+    # Next, validate the filters that were requested.
+    try:
+        min_price = float(request.query["min_price"]) if "min_price" in request.query else None
+        max_price = float(request.query["max_price"]) if "max_price" in request.query else None
+        limit = int(request.query.get("limit", __DEFAULT_SEARCH_LIMIT__))
+    except ValueError: return web.json_response({"success": False, "error_message": "Invalid number provided.", "status_code": 400}, status=200, content_type='application/json')
+    if any(price is not None and not math.isfinite(price) for price in [min_price, max_price]): return web.json_response({"success": False, "error_message": "Invalid number provided.", "status_code": 400}, status=200, content_type='application/json')
+    if limit < 1 or limit > __MAX_SEARCH_LIMIT__: return web.json_response({"success": False, "error_message": "The limit must be between 1 and " + str(__MAX_SEARCH_LIMIT__) + ".", "status_code": 400}, status=200, content_type='application/json')
+
+    cursor = request.query.get("cursor")
+    if cursor is not None and bot.utils.managers.shopManager.getItemFromItemID(cursor) is None: return web.json_response({"success": False, "error_message": "Unknown cursor.", "status_code": 400}, status=200, content_type='application/json')
+
+    # The balance is needed for the affordable filter, and is fetched while the members state is read.
+    economyUsers = EconomyUserCache(bot)
+    await economyUsers.startFetch(member_id)
+    context = bot.utils.managers.shopManager.getMemberContext(member_id, economyUsers)
+    economyUser = await economyUsers.getUser(member_id)
+    if economyUser is None: return _unknown_member()
+    context.balance = int(economyUser)
+
+    results = bot.utils.managers.shopManager.searchItems(
+        member_id,
+        context,
+        category=request.query.get("category"),
+        min_price=min_price,
+        max_price=max_price,
+        text=request.query.get("q"),
+        affordable=request.query.get("affordable") == "true",
+        available=request.query.get("available") == "true",
+        cursor=cursor,
+        limit=limit
+    )
+    return web.json_response({"success": True, "data": {"user": {"balance": context.balance}, **results}}, status=200, content_type='application/json')
+
+
+# This route purchases multiple items at once, given as a comma seperated list in the 'items' query argument.
+# The 'mode' query argument can either be 'atomic' (the default), where nothing is purchased unless every item
+# can be, or 'best_effort' where every item that can be purchased is. The updated view data is also returned
+# so the website does not need to make a second request to refresh the shop.
+@routes.get('/plugins/webshop/cart/{request_id}')
+@_instrumented("cart")
+@_rate_limited("cart")
+@_compressed
+async def get_cart(request):
+
+    bot = request.app["bot"]
+    request_id = request.match_info["request_id"]
+
+    # Attempt to get the member ID from the request.
+    member_id = bot.utils.managers.shopManager.getMemberIDFromRequestCode(request_id)
+    if member_id is None: return web.json_response({"success": False, "error_message": "Unknown identification code.", "status_code": 401}, status=200, content_type='application/json')
+
+    # Next, validate the items and mode that were requested.
+    item_ids = [item_id for item_id in request.query.get("items", "").split(",") if item_id != ""]
+    if len(item_ids) == 0: return web.json_response({"success": False, "error_message": "No item IDs were provided.", "status_code": 400}, status=200, content_type='application/json')
+    if len(item_ids) > __MAX_CART_ITEMS__: return web.json_response({"success": False, "error_message": "Too many items were provided.", "status_code": 400}, status=200, content_type='application/json')
+
+    mode = request.query.get("mode", "atomic")
+    if mode not in ["atomic", "best_effort"]: return web.json_response({"success": False, "error_message": "Unknown cart mode.", "status_code": 400}, status=200, content_type='application/json')
+
+    # Now we execute the purchase of every item and return the results alongside the updated view data.
+    # The economyUser fetched by the purchase is reused to build the view data.
+    economyUsers = EconomyUserCache(bot)
+    success, results = await bot.utils.managers.shopManager.purchaseItems(member_id, item_ids, atomic=(mode == "atomic"), economy_users=economyUsers)
+    # If the member could not be found then every purchase has failed and there is no view to build.
+    if await economyUsers.getUser(member_id) is None: return _unknown_member()
+    data, etag = _get_view_data(bot, await _get_view_context(bot, member_id, economyUsers))
+
+    body = b'{"success":true,"cart":' + json.dumps({"success": success, "items": results}, separators=(",", ":")).encode() + b',"data":' + data + b"}"
+    return web.Response(body=body, status=200, content_type='application/json')
+
+
 # This route is used by the Web Shop when running on a custom framework if a user is already
 # logged in, so they don't have to generate a shop link directly as the website is able to
 # generate and then use a request_id with the already stored Discord ID.
 @routes.get('/plugins/webshop/get_request_id/{user_id}')
+@_instrumented("get_request_id")
+@_rate_limited("get_request_id")
+@_compressed
 async def get_request_id(request):
 
     bot = request.app["bot"]
@@ -69,6 +307,22 @@ async def get_request_id(request):
     if not user_id.isdigit(): return web.json_response({"success": False, "error_message": "Provided user_id is invalid.", "status_code": 400}, status=200, content_type='application/json')
     if (await bot.getGuild()).get_member(int(user_id)) is None: return web.json_response({"success": False, "error_message": "You are not apart of the discord server!", "status_code": 401}, status=200, content_type='application/json')
 
+    # The members rate limit is only checked once we know they are in the guild, so made up user IDs
+    # are only limited by the global rate limit of the route.
+    retryAfter = bot.utils.managers.shopManager.checkRateLimit("get_request_id", member_id=int(user_id))
+    if retryAfter > 0: return _too_many_requests(retryAfter)
+
     # Now, since we know that the user_id provided is valid, we can simply use the shopManager
     # to get the request_id from the provided user_id.
     return web.json_response({"success": True, "request_id": bot.utils.managers.shopManager.generateLink(int(user_id), just_code=True)}, status=200, content_type='application/json')
+
+
+# This route serves the shop metrics in the Prometheus text format, so they can be scraped. It can be
+# disabled in the config if the API is publicly accessible.
+@routes.get('/plugins/webshop/metrics')
+@_compressed
+async def get_metrics(request):
+
+    bot = request.app["bot"]
+    if not bot.config.json["plugins"]["webshop"].get("metrics_enabled", True): return web.json_response({"success": False, "error_message": "Metrics are disabled.", "status_code": 404}, status=404, content_type='application/json')
+    return web.Response(text=bot.utils.managers.shopManager.metrics.render(), status=200, content_type='text/plain', headers={"X-Prometheus-Format": "0.0.4"})
@@ -0,0 +1,90 @@
+import bisect
+
+# These are the declarative availability rules of every item in the shop, compiled into bitmasks
+# where bit i stands for the i-th item. Instead of asking each item in turn if it is available, the
+# members state is walked once and every rule it breaks adds the bits of the items it makes
+# unavailable to a single mask. The only items that still need a Python call each are those with an
+# is_available callback or a get_available event, which are kept as the fallback.
+#
+# The rules are compiled from the items each time the catalog version changes, since any change to
+# an items rules also invalidates the catalog.
+class CompiledAvailabilityRules():
+    def __init__(self, items: list, version: int):
+        self.version: int = version
+        self.items: list = list(items)
+        self.bits: dict = {item.id: 1 << index for index, item in enumerate(self.items)}
+        self.allMask: int = (1 << len(self.items)) - 1
+
+        # These map an item ID found in the members state to the mask of items that are made
+        # unavailable by it.
+        self.limits: dict = {}
+        self.expiring: dict = {}
+        self.exclusiveGroups: dict = {}
+        self.excludedBy: dict = {}
+        self.requiredBy: dict = {}
+
+        # These map a condition key to the items that need the condition to be met, and the
+        # minimum balances (ascending) to the items that need at least that balance.
+        self.conditions: dict = {}
+        self._minBalances: list = []
+        self._minBalanceMasks: list = []
+
+        # Items that are always unavailable due to their available data key, and the items that
+        # have to be checked by invoking their callbacks as (bit, item).
+        self.unavailableMask: int = 0
+        self.fallbackItems: list = []
+
+        exclusiveMasks = {}
+        for item in self.items:
+            if item.group is not None and item._exclusive: exclusiveMasks[item.group] = exclusiveMasks.get(item.group, 0) | self.bits[item.id]
+
+        minBalances = {}
+        for item in self.items:
+            bit = self.bits[item.id]
+            if item._limit is not None: self.limits[item.id] = (item._limit, bit)
+            if item._expiry is not None: self.expiring[item.id] = bit
+            if item.group in exclusiveMasks: self.exclusiveGroups[item.id] = exclusiveMasks[item.group]
+            for item_id in item._excludedItems: self.excludedBy[item_id] = self.excludedBy.get(item_id, 0) | bit
+            for item_id in item._requiredItems: self.requiredBy[item_id] = self.requiredBy.get(item_id, 0) | bit
+            for key in item._conditions: self.conditions[key] = self.conditions.get(key, 0) | bit
+            if item._minBalance is not None: minBalances[item._minBalance] = minBalances.get(item._minBalance, 0) | bit
+
+            # An item with an is_available callback or a get_available event can only be decided by
+            # invoking them. Otherwise the available key of the item data is constant.
+            if "is_available" in item._callbacks or "get_available" in item._callbacks or item._isDynamicField("available"): self.fallbackItems.append((bit, item))
+            elif not item._hasField("available") or not item._getField("available"): self.unavailableMask |= bit
+
+        # Each minimum balance mask also holds the items of every higher minimum balance, so the items
+        # a member cannot afford to unlock are a single lookup.
+        self._minBalances = sorted(minBalances)
+        self._minBalanceMasks = [0] * (len(self._minBalances) + 1)
+        for index in range(len(self._minBalances) - 1, -1, -1):
+            self._minBalanceMasks[index] = self._minBalanceMasks[index + 1] | minBalances[self._minBalances[index]]
+
+    # Gets the mask of the items made unavailable by the declarative rules for the given context. The
+    # conditions are evaluated through the given function, which should cache the result per context.
+    def getBlockedMask(self, context, owned: set, evaluate_condition) -> int:
+        blocked = self.unavailableMask
+
+        for item_id, count in context.purchases.items():
+            limit = self.limits.get(item_id)
+            if limit is not None and count >= limit[0]: blocked |= limit[1]
+
+        for item_id in context.expiries:
+            blocked |= self.expiring.get(item_id, 0) | self.exclusiveGroups.get(item_id, 0)
+
+        for item_id in owned: blocked |= self.excludedBy.get(item_id, 0)
+        for item_id, mask in self.requiredBy.items():
+            if item_id not in owned: blocked |= mask
+
+        for key, mask in self.conditions.items():
+            if (blocked & mask) == mask: continue
+            if not evaluate_condition(key, context): blocked |= mask
+
+        if context.balance is not None: blocked |= self._minBalanceMasks[bisect.bisect_right(self._minBalances, context.balance)]
+
+        return blocked
+
+    # Converts a mask back into the item IDs it holds, in the order of the items.
+    def getItemIDs(self, mask: int) -> list:
+        return [item.id for item in self.items if mask & self.bits[item.id]]
@@ -0,0 +1,31 @@
+import random, timeit
+from plugins.webshop.benchmarks.stubs import createShopManager
+
+# Measures the cost of the item and request code lookups used on every shop request. The
+# cost per lookup should stay flat no matter how many items or request codes there are.
+# Run from the bot root directory with: python -m plugins.webshop.benchmarks.lookups
+
+__LOOKUPS__ = 100000
+
+def benchmarkItemLookups(item_count: int) -> float:
+    bot, manager = createShopManager()
+    for i in range(item_count):
+        manager.addItem(manager.createItem("item_" + str(i), category="Category " + str(i % 10), title="Item", description="", image="", price=i))
+
+    itemIDs = ["item_" + str(random.randrange(item_count)) for _ in range(__LOOKUPS__)]
+    return timeit.timeit(lambda: [manager.getItemFromItemID(item_id) for item_id in itemIDs], number=1) / __LOOKUPS__
+
+def benchmarkRequestCodeLookups(code_count: int) -> float:
+    bot, manager = createShopManager()
+    requestCodes = [manager.generateLink(member_id, just_code=True) for member_id in range(code_count)]
+
+    memberIDs = [random.randrange(code_count) for _ in range(__LOOKUPS__)]
+    codes = [random.choice(requestCodes) for _ in range(__LOOKUPS__)]
+    return timeit.timeit(lambda: ([manager.getRequestCodeFromMemberID(member_id) for member_id in memberIDs], [manager.getMemberIDFromRequestCode(code) for code in codes]), number=1) / (__LOOKUPS__ * 2)
+
+if __name__ == "__main__":
+    for itemCount in [10, 100, 1000, 10000]:
+        print("getItemFromItemID with " + str(itemCount) + " items: " + str(round(benchmarkItemLookups(itemCount) * 1e9)) + "ns/lookup")
+
+    for codeCount in [10, 1000, 100000]:
+        print("request code lookups with " + str(codeCount) + " issued codes: " + str(round(benchmarkRequestCodeLookups(codeCount) * 1e9)) + "ns/lookup")
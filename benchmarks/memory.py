@@ -0,0 +1,33 @@
+import argparse, gc, tracemalloc
+from plugins.webshop.benchmarks.stubs import createShopManager, addItems
+
+# Measures the memory used by each item in the shop, which is what limits how large a catalog can be
+# kept in the bot process. The items are created and added to a fresh shopManager while tracemalloc
+# is tracing, and the memory still held once the catalog has been built is divided over the items.
+# Run from the bot root directory with: python -m plugins.webshop.benchmarks.memory
+
+def measure(item_count: int) -> int:
+    bot, manager = createShopManager()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    addItems(manager, item_count)
+    manager.getCatalogJSON()
+
+    # The cached catalog is not part of the items themselves, so it is dropped before measuring.
+    manager._catalogCache = None
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename")) // item_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the memory used by each item in the shop.")
+    parser.add_argument("--items", type=int, default=10000, help="the amount of items in the catalog")
+    parser.add_argument("--target", type=int, default=1000, help="the target amount of bytes per item")
+    args = parser.parse_args()
+
+    bytesPerItem = measure(args.items)
+    print("items: " + str(args.items) + ", bytes per item: " + str(bytesPerItem) + ", target: " + str(args.target) + (" (met)" if bytesPerItem <= args.target else " (missed)"))
@@ -0,0 +1,54 @@
+import asyncio, time
+from plugins.webshop.benchmarks.stubs import createShopManager
+
+# Fires many concurrent purchases per member, as a double clicking user or a script would,
+# and checks that purchase limits and balances still hold. It also shows that purchases
+# for different members still run in parallel while each member's purchases are serialized.
+# Run from the bot root directory with: python -m plugins.webshop.benchmarks.purchase_race
+
+__MEMBERS__ = 200
+__PURCHASES_PER_MEMBER__ = 20
+__ECONOMY_LATENCY__ = 0.005
+__STARTING_BALANCE__ = 1000
+
+async def purchased(bot, buyer, item) -> None:
+    pass
+
+async def main() -> None:
+    bot, manager = createShopManager()
+    bot.utils.managers.economyManager.startingBalance = __STARTING_BALANCE__
+    bot.utils.managers.economyManager.latency = __ECONOMY_LATENCY__
+
+    # The limited item may only ever be purchased once, and the balance only allows for three
+    # purchases of the repeatable item, so any race would show up as a broken limit or balance.
+    limitedItem = manager.createItem("limited_item", category="Race", title="Limited", description="", image="", price=100)
+    limitedItem.setPurchaseLimit(1)
+    repeatableItem = manager.createItem("repeatable_item", category="Race", title="Repeatable", description="", image="", price=300)
+    for item in [limitedItem, repeatableItem]:
+        item.addEventCallback("purchased", purchased)
+        manager.addItem(item)
+
+    async def purchaseMany(member_id: int) -> list:
+        return await asyncio.gather(*[(limitedItem if i % 2 == 0 else repeatableItem).purchase(member_id) for i in range(__PURCHASES_PER_MEMBER__)])
+
+    start = time.perf_counter()
+    await purchaseMany(0)
+    singleMemberTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*[purchaseMany(member_id) for member_id in range(1, __MEMBERS__ + 1)])
+    allMembersTime = time.perf_counter() - start
+
+    failures = 0
+    for member_id in range(0, __MEMBERS__ + 1):
+        purchases = manager.getMemberPurchases(member_id)
+        balance = int(await bot.utils.managers.economyManager.getUser(member_id))
+        spent = 100 * purchases.get("limited_item", 0) + 300 * purchases.get("repeatable_item", 0)
+        if purchases.get("limited_item", 0) > 1 or balance < 0 or balance != __STARTING_BALANCE__ - spent: failures += 1
+
+    print("members with a broken limit or balance: " + str(failures))
+    print("1 member: " + str(round(singleMemberTime * 1000)) + "ms for " + str(__PURCHASES_PER_MEMBER__) + " purchases")
+    print(str(__MEMBERS__) + " members: " + str(round(allMembersTime * 1000)) + "ms for " + str(__MEMBERS__ * __PURCHASES_PER_MEMBER__) + " purchases (" + str(round(__MEMBERS__ * __PURCHASES_PER_MEMBER__ / allMembersTime)) + " purchases/sec)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
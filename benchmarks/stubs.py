@@ -0,0 +1,125 @@
+import random, string, asyncio
+from types import SimpleNamespace
+from typing import Optional
+
+# These are a minimal set of stand-ins for the parts of the Harold bot that the webshop
+# uses. They are only intended for the benchmarks, so they keep everything in memory and
+# do no Discord or network calls.
+
+class StubStateManager():
+    def __init__(self):
+        self.currentStateData = {}
+
+    def get(self, key: str):
+        if key not in self.currentStateData: return None
+        return self.currentStateData[key][0]
+
+    def set(self, key: str, value) -> None:
+        self.currentStateData[key] = [value]
+
+class StubUser():
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = "Member " + str(user_id)
+
+    async def send(self, *args, **kwargs) -> None:
+        pass
+
+class StubEconomyUser():
+    def __init__(self, user_id: int, balance: int):
+        self.userObject = StubUser(user_id)
+        self.balance = balance
+
+    def __int__(self) -> int:
+        return self.balance
+
+    def transaction(self, amount: int, reason: str) -> None:
+        self.balance += amount
+
+# The economy manager can be given a latency which is awaited on every getUser call, to
+# simulate the database or network round-trip of the real economy manager.
+class StubEconomyManager():
+    def __init__(self, starting_balance: int = 1000000, latency: float = 0):
+        self.startingBalance = starting_balance
+        self.latency = latency
+        self.users = {}
+
+    async def getUser(self, user_id: int) -> StubEconomyUser:
+        await asyncio.sleep(self.latency)
+        if user_id not in self.users: self.users[user_id] = StubEconomyUser(user_id, self.startingBalance)
+        return self.users[user_id]
+
+    def formatMoney(self, amount: int) -> str:
+        return "£" + format(int(amount), ",")
+
+class StubHookManager():
+    def __init__(self):
+        self.listeners = {}
+
+    def addListener(self, hook: str, callback) -> None:
+        self.listeners.setdefault(hook, []).append(callback)
+
+    def removeListener(self, hook: str, callback) -> None:
+        if callback in self.listeners.get(hook, []): self.listeners[hook].remove(callback)
+
+class StubCore():
+    def randomString(self, length: int = 50) -> str:
+        return "".join(random.choices(string.ascii_letters + string.digits, k=length))
+
+class StubBot():
+    def __init__(self, plugin_config: Optional[dict] = None):
+        webshopConfig = {
+            "shop_link": "https://my.website/shop",
+            "web_title": ["OUR SERVER", "POINT SHOP"],
+            "web_currency_symbol": "£",
+            "web_description": "Benchmark shop.",
+            "request_code_store": None,
+            "storage_path": ":memory:",
+
+            # The benchmarks send far more requests than a member would, so the API is not rate limited.
+            "rate_limits": {},
+            "global_rate_limits": {}
+        }
+        webshopConfig.update(plugin_config or {})
+
+        self.config = SimpleNamespace(json={"rootpath": ".", "cdn_link": "", "plugins": {"webshop": webshopConfig}})
+        self.utils = SimpleNamespace(
+            managers=SimpleNamespace(stateManager=StubStateManager(), economyManager=StubEconomyManager(), hookManager=StubHookManager()),
+            helpers=SimpleNamespace(core=StubCore())
+        )
+
+    # The benchmarks construct the shopManager directly without an event loop, so any
+    # background tasks it tries to start are simply discarded.
+    def create_task(self, coroutine, plugin: Optional[str] = None) -> None:
+        coroutine.close()
+
+    def log(self, message: str, error: bool = False) -> None:
+        pass
+
+    async def wait_until_ready(self) -> None:
+        pass
+
+    def get_user(self, user_id: int) -> StubUser:
+        return StubUser(user_id)
+
+# Creates a shopManager attached to a new StubBot, registering it in the same place the
+# plugin setup would so items are able to reference it.
+def createShopManager(plugin_config: Optional[dict] = None):
+    from plugins.webshop.shopManager import shopManager
+
+    bot = StubBot(plugin_config)
+    bot.utils.managers.shopManager = shopManager(bot)
+    return bot, bot.utils.managers.shopManager
+
+# Fills the shop with the given amount of items, spread over ten categories. Some items have a
+# purchase limit, an expiry or are in an exclusive group, so the availability rules are exercised.
+def addItems(manager, item_count: int) -> list:
+    items = []
+    for i in range(item_count):
+        item = manager.createItem("item_" + str(i), category="Category " + str(i % 10), title="Item " + str(i), description="Benchmark item.", image="https://my.website/item.png", price=100 + i)
+        if i % 5 == 1: item.setPurchaseLimit(1)
+        if i % 5 == 2: item.setExpiry(3600)
+        if i % 5 == 3: item.setExpiry(3600); item.setGroup("group_" + str(i % 3), exclusive=True)
+        manager.addItem(item)
+        items.append(item)
+    return items
@@ -0,0 +1,119 @@
+import argparse, asyncio, random, time
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+from plugins.webshop.benchmarks.stubs import createShopManager, addItems
+
+# Measures the main shop hot paths against the stub bot, reporting the throughput and latency
+# percentiles of each so that runs before and after a change can be compared. The catalog size,
+# member count and amount of pending expiries can be given as arguments, see --help.
+# Run from the bot root directory with: python -m plugins.webshop.benchmarks.suite
+
+# Runs the given coroutine function the given amount of times with at most 'concurrency' running
+# at once, returning the latency of each call and the total time taken.
+async def measure(function, count: int, concurrency: int = 1) -> tuple:
+    latencies = []; semaphore = asyncio.Semaphore(concurrency)
+    async def run(index: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await function(index)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run(index) for index in range(count)])
+    return latencies, time.perf_counter() - start
+
+def report(name: str, latencies: list, total_time: float) -> None:
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6
+    print(name.ljust(32) + str(round(len(latencies) / total_time)).rjust(10) + " ops/sec" + "".join([("  p" + str(p) + " ").rjust(7) + (str(round(percentile(p / 100))) + "us").rjust(9) for p in [50, 95, 99]]))
+
+async def benchmarkCategories(args) -> None:
+    bot, manager = createShopManager()
+    addItems(manager, args.items)
+    memberIDs = [random.randrange(args.members) for _ in range(args.iterations)]
+
+    async def run(index: int) -> None:
+        manager.getCategoriesForMemberID(memberIDs[index])
+    report("getCategoriesForMemberID", *await measure(run, args.iterations))
+
+async def benchmarkRoutes(args) -> None:
+    bot, manager = createShopManager()
+    items = addItems(manager, args.items)
+    codes = [manager.generateLink(member_id, just_code=True) for member_id in range(args.members)]
+
+    from plugins.webshop.api import routes
+    app = web.Application(); app["bot"] = bot; app.add_routes(routes)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+
+    try:
+        async def view(index: int) -> None:
+            response = await client.get("/plugins/webshop/view/" + random.choice(codes))
+            await response.read()
+            assert response.status == 200, "GET /view returned " + str(response.status)
+        report("GET /view", *await measure(view, args.iterations, args.concurrency))
+
+        # Only the items without limits or expiries are purchased, so that every purchase succeeds.
+        repeatableItems = [item.id for index, item in enumerate(items) if index % 5 in [0, 4]]
+        async def purchase(index: int) -> None:
+            response = await client.get("/plugins/webshop/purchase/" + random.choice(codes) + "/" + random.choice(repeatableItems))
+            await response.read()
+            assert response.status == 200, "GET /purchase returned " + str(response.status)
+        report("GET /purchase", *await measure(purchase, args.iterations, args.concurrency))
+
+    finally:
+        await client.close()
+
+async def benchmarkGenerateLink(args) -> None:
+    bot, manager = createShopManager()
+
+    # The first pass issues a new code to each member, and the second finds their existing code.
+    async def issue(index: int) -> None:
+        manager.generateLink(index)
+    report("generateLink (new members)", *await measure(issue, args.members))
+    report("generateLink (existing members)", *await measure(issue, args.members))
+
+async def benchmarkExpiries(args) -> None:
+    bot, manager = createShopManager()
+    items = [item for index, item in enumerate(addItems(manager, args.items)) if index % 5 == 2]
+    if len(items) == 0: print("expiry task skipped, since there are no items with an expiry"); return
+
+    # Every expiry is already due, so the expiry task has to work through all of them as fast as it can.
+    expiresAt = int(time.time()) - 1; changes = {}
+    for index in range(args.expiries):
+        member_id = index // len(items)
+        changes.setdefault(("expiries", member_id), {})[items[index % len(items)].id] = expiresAt
+    manager._storage.writeBatch(changes)
+
+    # Each batch is timed by wrapping the function the task calls for it, and the time is spread evenly
+    # over the expiries in the batch.
+    latencies = []; expireMemberItems = manager._expireMemberItems
+    async def timedExpireMemberItems(entries: list) -> None:
+        start = time.perf_counter()
+        await expireMemberItems(entries)
+        latencies.extend([(time.perf_counter() - start) / len(entries)] * len(entries))
+    manager._expireMemberItems = timedExpireMemberItems
+
+    start = time.perf_counter()
+    task = asyncio.ensure_future(manager._item_expiry_task())
+    while len(latencies) < args.expiries: await asyncio.sleep(0.01)
+    totalTime = time.perf_counter() - start
+    task.cancel()
+
+    report("expiry task (" + str(args.expiries) + " due)", latencies, totalTime)
+
+async def main(args) -> None:
+    print("items: " + str(args.items) + ", members: " + str(args.members) + ", iterations: " + str(args.iterations) + ", concurrency: " + str(args.concurrency))
+    benchmarks = {"categories": benchmarkCategories, "routes": benchmarkRoutes, "links": benchmarkGenerateLink, "expiries": benchmarkExpiries}
+    for name in args.only or benchmarks:
+        await benchmarks[name](args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the webshop hot paths against a stub bot.")
+    parser.add_argument("--items", type=int, default=50, help="the amount of items in the catalog")
+    parser.add_argument("--members", type=int, default=10000, help="the amount of members to spread the requests over")
+    parser.add_argument("--iterations", type=int, default=2000, help="the amount of calls to make to each benchmarked function or route")
+    parser.add_argument("--concurrency", type=int, default=1, help="the amount of route requests that are made at once")
+    parser.add_argument("--expiries", type=int, default=100000, help="the amount of due expiries for the expiry task to process")
+    parser.add_argument("--only", nargs="+", choices=["categories", "routes", "links", "expiries"], help="only run the given benchmarks")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,46 @@
+from typing import Any
+
+# The catalog columns hold the common fields of every item in the shop as parallel lists, with one
+# row per item, rather than each item holding its own dictionary of them. An item is given a row when
+# it is added to the shop, and the rows of removed items are reused by the next items that are added.
+# A field that an item does not have is stored as MISSING in its row.
+
+MISSING = object()
+
+class CatalogColumns():
+    FIELDS: tuple = ("category", "title", "description", "image", "price")
+
+    def __init__(self):
+        self.columns: dict = {field: [] for field in self.FIELDS}
+        self._freeRows: list = []
+
+    # Stores the given fields in a new row and returns the row.
+    def allocate(self, fields: dict) -> int:
+        if len(self._freeRows) > 0:
+            row = self._freeRows.pop()
+            for field, column in self.columns.items(): column[row] = fields.get(field, MISSING)
+
+        else:
+            row = len(self.columns["category"])
+            for field, column in self.columns.items(): column.append(fields.get(field, MISSING))
+
+        return row
+
+    # Frees the given row so that it can be reused, returning the fields it held.
+    def release(self, row: int) -> dict:
+        fields = {}
+        for field, column in self.columns.items():
+            if column[row] is not MISSING: fields[field] = column[row]
+            column[row] = MISSING
+
+        self._freeRows.append(row)
+        return fields
+
+    def get(self, field: str, row: int) -> Any:
+        return self.columns[field][row]
+
+    def set(self, field: str, row: int, value: Any) -> None:
+        self.columns[field][row] = value
+
+    def __len__(self) -> int:
+        return len(self.columns["category"]) - len(self._freeRows)
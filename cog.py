@@ -1,4 +1,4 @@
-import discord, asyncio, glob
+import discord, asyncio, os
 from discord.ext import commands
 from utils.models.plugin import Plugin
 from utils.models.interactions import Interactions
@@ -7,6 +7,9 @@ class WebShop(Plugin):
     def __init__(self, bot):
         self.bot = bot
 
+    def cog_unload(self) -> None:
+        self.bot.utils.managers.shopManager.close()
+
     @Interactions.slash(
         name="shop",
         description="Generate a link to the Discord Server point shop!",
@@ -23,6 +26,21 @@ class WebShop(Plugin):
 
         return await ctx.send(embed=embed, hidden=True)
 
+    @Interactions.slash(
+        name="shop_reload",
+        description="Reload any shop item files that have changed.",
+        permission="webshop.reload"
+    )
+    async def _shop_reload(self, ctx) -> None:
+
+        # Only the item files that have changed are reloaded, so the members state, shop links and
+        # pending expiries are all kept.
+        changedFiles = self.bot.utils.managers.shopManager.reloadChangedFiles()
+        if len(changedFiles) == 0: description = "None of the item files have changed."
+        else: description = "Reloaded the following item files:\n" + "\n".join(["``" + os.path.basename(filepath) + "``" for filepath in changedFiles])
+
+        return await ctx.send(embed=discord.Embed(title="Shop Reload", description=description), hidden=True)
+
 
 def setup(bot):
 
@@ -33,7 +51,6 @@ def setup(bot):
     bot.utils.add("managers", "shopManager", "plugins.webshop.shopManager")
 
     # Load all of the default items.
-    for itemFilepath in glob.glob(bot.config.json["rootpath"] + "/plugins/webshop/items/*.py"):
-        bot.utils.managers.shopManager.loadFile(itemFilepath)
+    bot.utils.managers.shopManager.loadItemFiles()
     
     bot.add_cog(WebShop(bot))
\ No newline at end of file
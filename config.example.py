@@ -26,3 +26,93 @@ CONFIG["web_currency_symbol"] = "£"
 # This is a light description about the Discord Server and the shop page. It is shown
 # at the very top of the page to all users.
 CONFIG["web_description"] = "A place for you to spend all of your hard earned cash on items that you can use in the Discord Server!"
+
+# Purchased and expired events (such as sending DMs or giving roles) are run in the background
+# by this many workers, so purchases do not wait for them. If an event fails it is retried this
+# many times, waiting the given amount of seconds before the first retry and doubling after each.
+# An event that takes longer than the timeout (in seconds) is cancelled and dropped without being
+# retried, since it may have already done part of its work. Setting the timeout to None lets events
+# run for as long as they need.
+CONFIG["side_effect_workers"] = 4
+CONFIG["side_effect_retries"] = 3
+CONFIG["side_effect_retry_delay"] = 2
+CONFIG["side_effect_timeout"] = 30
+
+# Expiries that are due are processed in batches of up to this size, which after downtime lets the
+# expiry task catch up on a backlog of overdue expiries without holding up the rest of the bot. The
+# expired events are run in the background by this many expiry workers.
+CONFIG["expiry_batch_size"] = 500
+CONFIG["expiry_workers"] = 8
+
+# The request codes used in shop links are stored in this file so that links keep working after
+# the bot restarts. Setting it to None keeps the codes in memory only. Codes expire after the given
+# amount of seconds (None to never expire), and once there are more codes than the limit the least
+# recently used codes are removed.
+CONFIG["request_code_store"] = "plugins/webshop/request_codes.log"
+CONFIG["request_code_ttl"] = 3600 * 24 * 30
+CONFIG["request_code_limit"] = 100000
+
+# Instead of storing the request codes, the mode can be set to "signed" which issues request codes
+# that are signed tokens holding the member ID and expiry. These are verified using the keys below
+# without storing anything, so multiple bot processes can share shop links. Keys are given as
+# key ID -> secret, and new codes are signed with the signing key. To rotate the keys, add a new key
+# and make it the signing key, then remove the old key once the codes it signed have expired.
+CONFIG["request_code_mode"] = "table"
+CONFIG["request_code_keys"] = {
+    "1": "CHANGE-ME-TO-A-LONG-RANDOM-SECRET"
+}
+CONFIG["request_code_signing_key"] = "1"
+
+# Changes to the members shop state (purchase counters and expiries) are buffered and written in
+# batches every given amount of seconds, or once the given amount of members have pending changes.
+# Any pending changes are also written when the plugin is unloaded. Setting the interval to zero
+# writes every change straight away.
+CONFIG["state_flush_interval"] = 1
+CONFIG["state_flush_size"] = 500
+
+# The members shop state is stored in an SQLite database at the given path. Any shop state from
+# older versions (stored in the stateManager) is copied into the database the first time it is used.
+# The backend can be set to "state" to keep using the stateManager instead.
+CONFIG["storage_backend"] = "sqlite"
+CONFIG["storage_path"] = "plugins/webshop/shop.db"
+
+# The item files are checked for changes every given amount of seconds, and any that have changed
+# are reloaded on their own without reloading the plugin. Setting it to zero disables the checks,
+# in which case the /shop_reload command can be used instead.
+CONFIG["item_reload_interval"] = 0
+
+# With lazy item loading, the items of each item file are recorded in the item manifest. On the next
+# startup any item file that has not changed is not imported, and its items are created from the
+# manifest instead. The file is then only imported once one of its items is purchased or expires.
+# Files that add hook listeners or conditions, or whose items have per member events, are always
+# imported. The manifest is updated automatically whenever an item file changes.
+CONFIG["lazy_item_loading"] = False
+CONFIG["item_manifest"] = "plugins/webshop/item_manifest.json"
+
+# The shop records metrics such as route latencies, item callback times and queue depths, which are
+# served in the Prometheus text format at '/plugins/webshop/metrics'. Any item event callback that takes
+# longer than the given amount of seconds is logged along with its module. Setting it to None disables
+# the slow callback logging.
+CONFIG["metrics_enabled"] = True
+CONFIG["slow_callback_threshold"] = 0.25
+
+# Responses of the API that are at least this many bytes are compressed with gzip, if the website
+# accepts it. Setting it to None disables compression.
+CONFIG["compression_threshold"] = 1024
+
+# The API routes are rate limited per member and per request code, with each request taking a token
+# from a bucket that holds up to 'burst' tokens and refills at 'rate' tokens per second. Requests over
+# the limit are answered with a 429 status and a Retry-After header. The global rate limits apply to
+# every request to the route, regardless of who made it. A route can be left out to not limit it. The
+# buckets are kept in a fixed size store, evicting the longest idle buckets once it is full.
+CONFIG["rate_limits"] = {
+    "view": {"rate": 2, "burst": 20},
+    "search": {"rate": 5, "burst": 30},
+    "purchase": {"rate": 2, "burst": 10},
+    "cart": {"rate": 1, "burst": 5},
+    "get_request_id": {"rate": 1, "burst": 5}
+}
+CONFIG["global_rate_limits"] = {
+    "get_request_id": {"rate": 100, "burst": 200}
+}
+CONFIG["rate_limit_buckets"] = 100000
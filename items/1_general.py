@@ -1,17 +1,19 @@
 import discord, datetime
-from plugins.webshop.shopManager import Item, GenericItemCallbacks
+from typing import Optional
+from plugins.webshop.shopManager import Item, GenericItemCallbacks, MemberShopContext
 
 __VIP_ROLE_ID__ = 935276275382222848
 __VIP_CHANNEL_ID__ = 935276598083608636
 
-async def purchased_request_from_staff(bot, buyer: discord.User, item: Item) -> None:
-    itemData = item.getData(buyer.id); ecoUser = await bot.utils.managers.economyManager.getUser(buyer.id)
+async def purchased_request_from_staff(bot, buyer: discord.User, item: Item, context: Optional[MemberShopContext] = None) -> None:
+    if context is None: context = MemberShopContext(bot, buyer.id)
+    itemData = item.getData(buyer.id, context); ecoUser = await context.economyUsers.getUser(buyer.id)
     embed = discord.Embed(title="Request From Staff", description="You brought a **" + itemData["title"] + "** for ``" + bot.utils.managers.economyManager.formatMoney(itemData["price"]) + "``. You now have ``" + bot.utils.managers.economyManager.formatMoney(int(ecoUser)) + "``. To get your item, please contact an Administrator!", timestamp=datetime.datetime.utcnow())
     embed.set_image(url=itemData["image"] if "image" in itemData else "https://t3.ftcdn.net/jpg/02/26/34/20/360_F_226342059_IYzkHaiDJB2B179CvxfhnDWlVMwlBcVK.jpg")
     try: await buyer.send(embed=embed)
     except Exception: pass
 
-async def purchased_vip_pass(bot, buyer: discord.User, item: Item) -> None:
+async def purchased_vip_pass(bot, buyer: discord.User, item: Item, context: Optional[MemberShopContext] = None) -> None:
 
     # Get a reference to the guild so the member can be gathered. We then also get
     # a reference to the VIP role to give to the member.
@@ -32,7 +34,7 @@ async def purchased_vip_pass(bot, buyer: discord.User, item: Item) -> None:
         try: await channel.send(":partying_face:  Welcome our latest V.I.P  <@" + str(buyer.id) + ">!")
         except Exception: bot.log("Failed to send message into VIP channel.", error=True)
 
-    await GenericItemCallbacks.purchased(bot, buyer, item)
+    await GenericItemCallbacks.purchased(bot, buyer, item, context=context)
 
 def setup(bot) -> None:
     
@@ -9,20 +9,11 @@ from plugins.webshop.shopManager import Item, GenericItemCallbacks
 # we should deploy/use any protection items if we have them.
 async def economy_can_robbery_succeed(bot, ctx, target: discord.Member) -> Optional[bool]:
 
-    # First we should get the targets items that have not yet expired.
-    targetExpiries = bot.utils.managers.stateManager.get("shop-expiry-" + str(target.id))
-    if targetExpiries is None: return
-
-    # Next, go through all the items that the user has and check for any
-    # that are protection items.
-    active_item_id = None
-    for item_id in targetExpiries:
-        if item_id in ["protection_shield", "protection_mirror", "protection_armed_security"]:
-            active_item_id = item_id
-    
+    # First we should get the targets protection items that have not yet expired.
     # If the target does not have any protection items, just return.
-    if active_item_id is None: return
-    protection_item = bot.utils.managers.shopManager.getItemFromItemID(active_item_id)
+    activeItemIDs = bot.utils.managers.shopManager.getActiveGroupItems(target.id, "protection")
+    if len(activeItemIDs) == 0: return
+    protection_item = bot.utils.managers.shopManager.getItemFromItemID(next(iter(activeItemIDs)))
     if protection_item is None: return
 
     # Here we create the embed that will be sent in place of the original robbery message.
@@ -90,28 +81,15 @@ def get_badges(bot, item: Item) -> dict:
         "Single Use": "btn-danger"
     }
 
-# The availability function is fairly simple. Since we do not want the user to
-# be able to purchase multiple protection items, we simply check to see if they
-# have any of the protection item ID's in their expiry data.
-def is_available(bot, member_id: int, item: Item) -> bool:
-    userExpiries = bot.utils.managers.stateManager.get("shop-expiry-" + str(member_id))
-    if userExpiries is None: return True
-
-    # If they do have some items on expiry, check to see if any of them are protection
-    # items by checking their item ID.
-    for item_id in userExpiries:
-        if item_id.startswith("protection_"): return False
-
-    # Finally, if they have no protection items active return True.    
-    return True
-
 def setup(bot) -> None:
     
     # First, we setup the robbery event so we can actually do stuff when the user
-    # gets robbed.
-    bot.utils.managers.hookManager.addListener("economy_core.can_user_robbery_success", economy_can_robbery_succeed)
+    # gets robbed. This goes through the shopManager so the listener is replaced if
+    # this file is reloaded.
+    bot.utils.managers.shopManager.addHookListener("economy_core.can_user_robbery_success", economy_can_robbery_succeed)
 
-    # Add a basic description for how the category works.
+    # Add a basic description for how the category works. Since we do not want the user to be able
+    # to purchase multiple protection items, each item is in the exclusive protection group.
     bot.utils.managers.shopManager.setCategorySubtitle("Protection", "These items are used to protect yourself from robbery attempts. They are only activated if the robbery was actually successful, and expire after they're used. You cannot own more than one protection item at a time.")
 
     shieldItem = bot.utils.managers.shopManager.createItem("protection_shield",
@@ -121,9 +99,9 @@ def setup(bot) -> None:
         image="https://progameguides.com/wp-content/uploads/2019/08/fortnite-back-bling-banner-shield.jpg",
         price=25000
     )
-    shieldItem.addEventCallback("is_available", is_available)
     shieldItem.addEventCallback("get_badges", get_badges)
     shieldItem.setExpiry(3600 * 4)
+    shieldItem.setGroup("protection", exclusive=True)
     
     mirrorItem = bot.utils.managers.shopManager.createItem("protection_mirror",
         category="Protection",
@@ -132,9 +110,9 @@ def setup(bot) -> None:
         image="https://st4.depositphotos.com/1781787/31564/i/450/depositphotos_315641368-stock-photo-dark-room-magical-antique-mirror.jpg",
         price=50000
     )
-    mirrorItem.addEventCallback("is_available", is_available)
     mirrorItem.addEventCallback("get_badges", get_badges)
     mirrorItem.setExpiry(3600 * 4)
+    mirrorItem.setGroup("protection", exclusive=True)
     
     armedSecurityItem = bot.utils.managers.shopManager.createItem("protection_armed_security",
         category="Protection",
@@ -143,9 +121,9 @@ def setup(bot) -> None:
         image="https://www.ziprecruiter.com/svc/fotomat/public-ziprecruiter/cms/506138376ArmedPrivateSecurity.jpg",
         price=75000
     )
-    armedSecurityItem.addEventCallback("is_available", is_available)
     armedSecurityItem.addEventCallback("get_badges", get_badges)
     armedSecurityItem.setExpiry(3600 * 4)
+    armedSecurityItem.setGroup("protection", exclusive=True)
 
     # Finally, we add the items to the shop.
     bot.utils.managers.shopManager.addItem(shieldItem)
@@ -1,8 +1,9 @@
 import discord
-from plugins.webshop.shopManager import Item, GenericItemCallbacks
+from typing import Optional
+from plugins.webshop.shopManager import Item, GenericItemCallbacks, MemberShopContext
 
 # Here, we send a simple DM to the user who purchases the item.
-async def purchased(bot, buyer: discord.User, item: Item) -> None:
+async def purchased(bot, buyer: discord.User, item: Item, context: Optional[MemberShopContext] = None) -> None:
     if item.id == "cooldown_reset_robbery_user":
         if str(buyer.id) in bot.getCog("economy_core").commandTimeouts["rob"]:
             del bot.getCog("economy_core").commandTimeouts["rob"][str(buyer.id)]
@@ -20,19 +21,25 @@ async def purchased(bot, buyer: discord.User, item: Item) -> None:
             
     # After actually resetting the users cooldown we just pass over to a generic
     # callback handler to do the rest (informing the buyer).
-    return await GenericItemCallbacks.purchased(bot, buyer, item)
+    return await GenericItemCallbacks.purchased(bot, buyer, item, context=context)
 
 # This ensures that only people who actually have a robbery cooldown can pay to
-# reset their robbery cooldown.
-def does_user_have_rob_cooldown(bot, member_id: int, item: Item) -> bool:
+# reset their robbery cooldown. It is registered as a per member condition.
+def does_user_have_rob_cooldown(bot, member_id: int) -> bool:
     return str(member_id) in bot.getCog("economy_core").commandTimeouts["rob"]
 
 # This ensures that the charity robbery cooldown reset can only be purchased when
-# the charity robbery is on a cooldown.
-def does_charity_have_cooldown(bot, member_id: int, item: Item) -> bool:
+# the charity robbery is on a cooldown. Since the cooldown is shared by everyone it
+# is registered as a global condition.
+def does_charity_have_cooldown(bot) -> bool:
     return not bot.getCog("economy_core").commandTimeouts["charity"] is None
 
 def setup(bot) -> None:
+
+    # The cooldowns are registered as conditions so they are only checked once per
+    # page load, rather than once for each item that uses them.
+    bot.utils.managers.shopManager.registerCondition("rob_cooldown", does_user_have_rob_cooldown)
+    bot.utils.managers.shopManager.registerCondition("charity_cooldown", does_charity_have_cooldown, per_member=False)
     
     resetUserRobbery = bot.utils.managers.shopManager.createItem("cooldown_reset_robbery_user",
         category="Cooldowns",
@@ -41,7 +48,7 @@ def setup(bot) -> None:
         image="https://st3.depositphotos.com/1076504/13796/i/450/depositphotos_137963564-stock-photo-burglars-breaks-into-house-at.jpg",
         price=15000
     )
-    resetUserRobbery.addEventCallback("is_available", does_user_have_rob_cooldown)
+    resetUserRobbery.addCondition("rob_cooldown")
     resetUserRobbery.addEventCallback("purchased", purchased)
 
     resetCharityRobbery = bot.utils.managers.shopManager.createItem("cooldown_reset_robbery_charity",
@@ -51,7 +58,7 @@ def setup(bot) -> None:
         image="https://wallpaperaccess.com/full/2648103.jpg",
         price=75000
     )
-    resetCharityRobbery.addEventCallback("is_available", does_charity_have_cooldown)
+    resetCharityRobbery.addCondition("charity_cooldown")
     resetCharityRobbery.addEventCallback("purchased", purchased)
 
     # Finally, we add the items to the shop.
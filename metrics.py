@@ -0,0 +1,126 @@
+import bisect, time
+from typing import Callable, Optional, Tuple
+
+# These are a minimal set of Prometheus style metrics used to instrument the webshop. Each metric
+# has a fixed set of label names, and its values are kept per combination of label values. The
+# registry renders every metric in the Prometheus text format, which is served by the metrics route.
+
+__DEFAULT_BUCKETS__ = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Counter():
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name: str = name
+        self.description: str = description
+        self.labels: Tuple[str, ...] = labels
+        self._values: dict = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " counter"]
+        for labelValues, value in self._values.items():
+            lines.append(self.name + _formatLabels(self.labels, labelValues) + " " + _formatValue(value))
+        return lines
+
+# A histogram counts the observed values into cumulative buckets, alongside their sum and count, so
+# that percentiles can be estimated by Prometheus.
+class Histogram():
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = __DEFAULT_BUCKETS__):
+        self.name: str = name
+        self.description: str = description
+        self.labels: Tuple[str, ...] = labels
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._values: dict = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        values = self._values.get(label_values)
+        if values is None:
+            values = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._values[label_values] = values
+
+        values[0][bisect.bisect_left(self.buckets, value)] += 1
+        values[1] += value
+        values[2] += 1
+
+    def render(self) -> list:
+        lines = ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " histogram"]
+        for labelValues, (bucketCounts, total, count) in self._values.items():
+            cumulative = 0
+            for bucket, bucketCount in zip(self.buckets + (float("inf"),), bucketCounts):
+                cumulative += bucketCount
+                lines.append(self.name + "_bucket" + _formatLabels(self.labels + ("le",), labelValues + ("+Inf" if bucket == float("inf") else _formatValue(bucket),)) + " " + str(cumulative))
+            lines.append(self.name + "_sum" + _formatLabels(self.labels, labelValues) + " " + _formatValue(total))
+            lines.append(self.name + "_count" + _formatLabels(self.labels, labelValues) + " " + str(count))
+        return lines
+
+# A gauge reads its value from a callback when the metrics are rendered, which is used for values
+# such as queue depths that are already known elsewhere.
+class Gauge():
+    def __init__(self, name: str, description: str, callback: Callable[[], float]):
+        self.name: str = name
+        self.description: str = description
+        self.callback: Callable[[], float] = callback
+
+    def render(self) -> list:
+        return ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " gauge", self.name + " " + _formatValue(self.callback())]
+
+# This times the code within it and observes the duration on the given histogram once it exits, even
+# if an exception was raised.
+class Timer():
+    def __init__(self, histogram: Histogram, *label_values):
+        self.histogram: Histogram = histogram
+        self.labelValues: tuple = label_values
+        self.start: Optional[float] = None
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelValues)
+
+# This times a sequence of phases, observing the time since the previous mark each time a phase is
+# marked as finished. The phase name is given as the last label value.
+class PhaseTimer():
+    def __init__(self, histogram: Histogram, *label_values):
+        self.histogram: Histogram = histogram
+        self.labelValues: tuple = label_values
+        self.last: float = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, *(self.labelValues + (phase,)))
+        self.last = now
+
+class MetricsRegistry():
+    def __init__(self):
+        self._metrics: dict = {}
+
+    def counter(self, name: str, description: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = __DEFAULT_BUCKETS__) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name: str, description: str, callback: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, description, callback))
+
+    # Renders every metric in the Prometheus text exposition format.
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values(): lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        if metric.name in self._metrics: raise KeyError("A metric named '" + metric.name + "' has already been registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+def _formatLabels(names: Tuple[str, ...], values: tuple) -> str:
+    if len(names) == 0: return ""
+    return "{" + ",".join([name + '="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"' for name, value in zip(names, values)]) + "}"
+
+def _formatValue(value: float) -> str:
+    if isinstance(value, int): return str(value)
+    return repr(float(value))
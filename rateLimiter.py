@@ -0,0 +1,37 @@
+import collections, time
+from typing import Hashable, Optional
+
+# This is a set of token buckets used to rate limit the API. Each key (such as a route and request code)
+# has a bucket holding up to 'burst' tokens, which refills at 'rate' tokens per second, and each request
+# takes a token. The buckets are kept in a fixed size LRU, so once it is full the bucket that has been
+# idle the longest is evicted. An evicted bucket would usually have refilled by then anyway, in which
+# case a new bucket is the same as the one that was evicted. Every operation is O(1).
+class RateLimiter():
+    def __init__(self, max_buckets: int = 100000):
+        self.maxBuckets: int = max_buckets
+        self._buckets = collections.OrderedDict()
+
+    # Takes a token from the bucket of the key. If a token was taken then 0 is returned, otherwise the
+    # amount of seconds until the next token is available. The rate must be greater than zero.
+    def acquire(self, key: Hashable, rate: float, burst: float, now: Optional[float] = None) -> float:
+        if now is None: now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(burst), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.maxBuckets: self._buckets.popitem(last=False)
+
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+
+        return (1 - bucket[0]) / rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -0,0 +1,191 @@
+import os, time, collections, hmac, hashlib, base64, binascii
+from typing import Optional
+
+# The request code store holds the request codes that have been issued to members, which is what
+# the shop links are authenticated with. Codes expire after a TTL, and once the store is full the
+# least recently used code is evicted, so the memory used stays bounded.
+#
+# Every change is appended to a log file so the codes survive a restart or a plugin reload. Each
+# line of the log is either "+<code> <member_id> <expires_at>" when a code is issued or "-<code>"
+# when it is removed. The log is only read the first time the store is used, and once it contains
+# too many outdated lines it is compacted by rewriting it with just the current codes.
+class RequestCodeStore():
+    def __init__(self, filepath: Optional[str] = None, ttl: Optional[int] = None, max_codes: int = 100000):
+        self.filepath: Optional[str] = filepath
+        self.ttl: Optional[int] = ttl
+        self.maxCodes: int = max_codes
+
+        # The codes are stored as code -> (member_id, expires_at), ordered from the least to the
+        # most recently used. There is also a reverse index to get the code of a member.
+        self._codes = collections.OrderedDict()
+        self._memberCodes: dict = {}
+
+        self._loaded: bool = False
+        self._logFile = None
+        self._logLines: int = 0
+
+    def getMemberID(self, request_code: str) -> Optional[int]:
+        self._ensureLoaded()
+        entry = self._codes.get(request_code)
+        if entry is None: return None
+
+        # If the code has expired we can remove it now, since it will never be valid again.
+        if entry[1] is not None and entry[1] <= time.time():
+            self.remove(request_code)
+            return None
+
+        self._codes.move_to_end(request_code)
+        return entry[0]
+
+    def getCode(self, member_id: int) -> Optional[str]:
+        self._ensureLoaded()
+        requestCode = self._memberCodes.get(int(member_id))
+        if requestCode is None: return None
+        if self.getMemberID(requestCode) is None: return None
+        return requestCode
+
+    def add(self, request_code: str, member_id: int) -> None:
+        self._ensureLoaded()
+
+        # A member only ever has a single code, so any existing code for the member is replaced.
+        existingCode = self._memberCodes.get(int(member_id))
+        if existingCode is not None: self.remove(existingCode)
+
+        expiresAt = None if self.ttl is None else int(time.time()) + self.ttl
+        self._insert(request_code, int(member_id), expiresAt)
+        self._writeLog("+" + request_code + " " + str(int(member_id)) + " " + str(expiresAt))
+
+        # If the store is now over its limit, evict the least recently used codes.
+        while len(self._codes) > self.maxCodes:
+            self.remove(next(iter(self._codes)))
+
+    def remove(self, request_code: str) -> None:
+        entry = self._codes.pop(request_code, None)
+        if entry is None: return
+        if self._memberCodes.get(entry[0]) == request_code: del self._memberCodes[entry[0]]
+        self._writeLog("-" + request_code)
+
+    def __len__(self) -> int:
+        self._ensureLoaded()
+        return len(self._codes)
+
+    # Rewrites the log so that it only contains the codes that are currently stored, leaving out any
+    # codes that have since expired.
+    def compact(self) -> None:
+        self._ensureLoaded()
+        if self.filepath is None: return
+        if self._logFile is not None: self._logFile.close(); self._logFile = None
+
+        now = time.time()
+        for requestCode, entry in list(self._codes.items()):
+            if entry[1] is None or entry[1] > now: continue
+            del self._codes[requestCode]
+            if self._memberCodes.get(entry[0]) == requestCode: del self._memberCodes[entry[0]]
+
+        # The log is written to a temporary file first and then moved over the old log, so that the
+        # log is never left half written.
+        with open(self.filepath + ".tmp", "w") as logFile:
+            for requestCode, entry in self._codes.items():
+                logFile.write("+" + requestCode + " " + str(entry[0]) + " " + str(entry[1]) + "\n")
+        os.replace(self.filepath + ".tmp", self.filepath)
+        self._logLines = len(self._codes)
+
+    def close(self) -> None:
+        if self._logFile is not None: self._logFile.close()
+        self._logFile = None
+
+    def _insert(self, request_code: str, member_id: int, expires_at: Optional[int]) -> None:
+        self._codes[request_code] = (member_id, expires_at)
+        self._codes.move_to_end(request_code)
+        self._memberCodes[member_id] = request_code
+
+    def _writeLog(self, line: str) -> None:
+        if self.filepath is None: return
+        if self._logFile is None: self._logFile = open(self.filepath, "a")
+        self._logFile.write(line + "\n"); self._logFile.flush()
+        self._logLines += 1
+
+        # Once most of the log is made up of removed or replaced codes, compact it.
+        if self._logLines > 1000 and self._logLines > len(self._codes) * 2: self.compact()
+
+    # Loads the codes from the log the first time the store is used. Codes that have expired
+    # are skipped, and the store limit is applied as if the codes were issued again in order.
+    def _ensureLoaded(self) -> None:
+        if self._loaded: return
+        self._loaded = True
+        if self.filepath is None or not os.path.isfile(self.filepath): return
+
+        now = time.time()
+        with open(self.filepath, "r") as logFile:
+            for line in logFile:
+                line = line.rstrip("\n"); self._logLines += 1
+                if line.startswith("-"):
+                    entry = self._codes.pop(line[1:], None)
+                    if entry is not None and self._memberCodes.get(entry[0]) == line[1:]: del self._memberCodes[entry[0]]
+                    continue
+
+                # Any line that cannot be parsed was most likely only partially written when the bot
+                # stopped, so it is ignored.
+                parts = line[1:].split(" ")
+                if not line.startswith("+") or len(parts) != 3 or not parts[1].isdigit(): continue
+                expiresAt = None if parts[2] == "None" else int(parts[2])
+                if expiresAt is not None and expiresAt <= now: continue
+
+                existingCode = self._memberCodes.get(int(parts[1]))
+                if existingCode is not None: self._codes.pop(existingCode, None)
+                self._insert(parts[0], int(parts[1]), expiresAt)
+
+        while len(self._codes) > self.maxCodes:
+            requestCode, entry = self._codes.popitem(last=False)
+            if self._memberCodes.get(entry[0]) == requestCode: del self._memberCodes[entry[0]]
+
+# This is an alternative to the request code store which issues self contained tokens instead. Each
+# token holds the member ID, the time it was issued and when it expires, signed with a HMAC key. This
+# means tokens can be verified without storing anything, so multiple bot or API processes can verify
+# the same shop links as long as they share the keys. The keys are given as key_id -> secret, where
+# the key ID is included in each token. New tokens are signed with the signing key, and tokens signed
+# with any of the other keys are still accepted, which allows the keys to be rotated.
+class SignedRequestTokens():
+    def __init__(self, keys: dict, signing_key: str, ttl: Optional[int] = None):
+        if signing_key not in keys: raise KeyError("The signing key '" + str(signing_key) + "' is not one of the request code keys.")
+        if any("." in str(keyID) for keyID in keys): raise ValueError("Request code key IDs cannot contain a '.' character.")
+        self.keys: dict = {str(keyID): str(secret).encode() for keyID, secret in keys.items()}
+        self.signingKey: str = str(signing_key)
+        self.ttl: Optional[int] = ttl
+
+    def issue(self, member_id: int) -> str:
+        issuedAt = int(time.time())
+        expiresAt = 0 if self.ttl is None else issuedAt + self.ttl
+        payload = _encode((str(int(member_id)) + ":" + str(issuedAt) + ":" + str(expiresAt)).encode())
+        return self.signingKey + "." + payload + "." + self._sign(self.signingKey, payload)
+
+    def getMemberID(self, request_code: str) -> Optional[int]:
+        parts = request_code.split(".")
+        if len(parts) != 3 or parts[0] not in self.keys: return None
+        # The signatures are compared as bytes, as compare_digest only accepts ASCII strings and the
+        # request code could contain anything.
+        if not hmac.compare_digest(parts[2].encode(), self._sign(parts[0], parts[1]).encode()): return None
+
+        # Now that the signature has been verified we know that the payload was created by us, so the
+        # only thing left to check is that the token has not expired.
+        try: member_id, issuedAt, expiresAt = [int(value) for value in _decode(parts[1]).decode().split(":")]
+        except ValueError: return None
+        if expiresAt != 0 and expiresAt <= time.time(): return None
+        return member_id
+
+    # Tokens are not stored, so there is never an existing token to return for a member.
+    def getCode(self, member_id: int) -> Optional[str]:
+        return None
+
+    def close(self) -> None:
+        pass
+
+    def _sign(self, key_id: str, payload: str) -> str:
+        return _encode(hmac.new(self.keys[key_id], (key_id + "." + payload).encode(), hashlib.sha256).digest())
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _decode(data: str) -> bytes:
+    try: return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (ValueError, binascii.Error): return b""
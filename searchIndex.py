@@ -0,0 +1,96 @@
+import bisect, re
+from typing import Optional
+
+# This is an index over the catalog used to search and filter the items of the shop without scanning
+# every item. Items are referred to by their position in the catalog, which is also their bit in the
+# compiled availability rules. The index holds the positions of each category, the static prices in
+# ascending order and an inverted index of the words in each items title and description.
+#
+# Fields that are dynamic or cached with a TTL can change without the catalog version changing, so
+# items whose price, title or description are one of those are not indexed by that field. Instead they
+# are always returned as candidates and it is left to the caller to check them with their real values.
+#
+# Like the compiled rules, the index is built for a catalog version and rebuilt once it changes.
+class CatalogSearchIndex():
+    def __init__(self, items: list, version: int):
+        self.version: int = version
+        self.items: list = list(items)
+        self.positions: dict = {item.id: position for position, item in enumerate(self.items)}
+        self.categories: dict = {}
+
+        # The prices are kept as two parallel lists so that a price range is found with bisect.
+        self._prices: list = []
+        self._pricePositions: list = []
+        self.unindexedPrices: set = set()
+
+        self.tokens: dict = {}
+        self.unindexedText: set = set()
+
+        prices = []
+        for position, item in enumerate(self.items):
+            self.categories.setdefault(item.category, set()).add(position)
+
+            if self._isIndexable(item, "price"):
+                price = item._getStaticField("price") if item._hasField("price") else None
+                if isinstance(price, (int, float)): prices.append((price, position))
+
+            else: self.unindexedPrices.add(position)
+
+            if self._isIndexable(item, "title") and self._isIndexable(item, "description"):
+                for token in tokenize(" ".join([str(item._getStaticField(key)) for key in ["title", "description"] if item._hasField(key)])):
+                    self.tokens.setdefault(token, set()).add(position)
+
+            else: self.unindexedText.add(position)
+
+        # Each indexed word is also indexed by the three letter sequences it contains, so the words that
+        # contain a search word are found without scanning every word.
+        self._trigrams: dict = {}
+        for token in self.tokens:
+            for trigram in _trigrams(token): self._trigrams.setdefault(trigram, set()).add(token)
+
+        prices.sort()
+        self._prices = [price for price, position in prices]
+        self._pricePositions = [position for price, position in prices]
+
+    # Gets the positions of the items with a static price within the given range, along with the items
+    # whose price could not be indexed.
+    def getPriceRange(self, min_price: Optional[float] = None, max_price: Optional[float] = None) -> set:
+        start = 0 if min_price is None else bisect.bisect_left(self._prices, min_price)
+        end = len(self._prices) if max_price is None else bisect.bisect_right(self._prices, max_price)
+        return set(self._pricePositions[start:end]) | self.unindexedPrices
+
+    # Gets the positions of the items whose title or description contain every word of the given text,
+    # along with the items whose text could not be indexed. A search word matches every indexed word it
+    # is part of, so searching for 'arm' matches 'armour' and 'charm', the same as the unindexed items are
+    # checked by the caller. The indexed words containing a search word are found through the words that
+    # share all of its three letter sequences, while search words shorter than that are checked against
+    # every indexed word.
+    def getTextMatches(self, text: str) -> set:
+        matches = None
+        for queryToken in tokenize(text):
+            candidates = self.tokens
+            if len(queryToken) >= 3:
+                candidates = None
+                for tokens in sorted([self._trigrams.get(trigram, set()) for trigram in _trigrams(queryToken)], key=len):
+                    candidates = set(tokens) if candidates is None else candidates & tokens
+                    if len(candidates) == 0: break
+
+            positions = set()
+            for token in candidates:
+                if queryToken in token: positions |= self.tokens[token]
+
+            matches = positions if matches is None else matches & positions
+
+        if matches is None: return set(range(len(self.items)))
+        return matches | self.unindexedText
+
+    def _isIndexable(self, item, key: str) -> bool:
+        return not item._isDynamicField(key) and key not in item._fieldTTLs
+
+# Gets the three letter sequences of a word.
+def _trigrams(token: str) -> set:
+    return {token[index:index + 3] for index in range(len(token) - 2)}
+
+# Splits text into the lowercase words used by the token index.
+def tokenize(text: str) -> list:
+    return re.findall(r"\w+", str(text).lower())
@@ -1,13 +1,22 @@
 from ast import mod
-import discord, inspect, traceback, time, datetime, asyncio
-from types import ModuleType
-from typing import Union, Optional, Callable, Any, Tuple
+import discord, inspect, traceback, time, datetime, asyncio, heapq, json, hashlib, weakref, collections, os, bisect, sys, glob, importlib
+from types import ModuleType, MappingProxyType
+from typing import Union, Optional, Callable, Any, Tuple, Mapping
+
+from plugins.webshop.requestCodeStore import RequestCodeStore, SignedRequestTokens
+from plugins.webshop.shopStorage import WriteBehindBuffer, SQLiteStorage, StateManagerStorage
+from plugins.webshop.availabilityRules import CompiledAvailabilityRules
+from plugins.webshop.metrics import MetricsRegistry, Timer, PhaseTimer
+from plugins.webshop.catalogColumns import CatalogColumns, MISSING
+from plugins.webshop.searchIndex import CatalogSearchIndex, tokenize
+from plugins.webshop.rateLimiter import RateLimiter
 
 # These are a collection of generic callbacks that can be used for items that
 # are generic enough to share callbacks.
 class GenericItemCallbacks:
-    async def purchased(bot, buyer: discord.User, item) -> None:
-        itemData = item.getData(buyer.id); ecoUser = await bot.utils.managers.economyManager.getUser(buyer.id)
+    async def purchased(bot, buyer: discord.User, item, context: Optional["MemberShopContext"] = None) -> None:
+        if context is None: context = MemberShopContext(bot, buyer.id)
+        itemData = item.getData(buyer.id, context); ecoUser = await context.economyUsers.getUser(buyer.id)
         embed = discord.Embed(title="Purchase Successful", description="You brought **" + itemData["title"] + "** for ``" + bot.utils.managers.economyManager.formatMoney(itemData["price"]) + "``. You now have ``" + bot.utils.managers.economyManager.formatMoney(int(ecoUser)) + "``.", timestamp=datetime.datetime.utcnow())
         if item._expiry: embed.add_field(name="Expiry", value="This item automatically expires in: ``" + str(datetime.timedelta(seconds=item._expiry)) + "``", inline=False)
         embed.set_image(url=itemData["image"] if "image" in itemData else "https://t3.ftcdn.net/jpg/02/26/34/20/360_F_226342059_IYzkHaiDJB2B179CvxfhnDWlVMwlBcVK.jpg")
@@ -22,35 +31,155 @@ class GenericItemCallbacks:
         except Exception: pass
 
 
+# This is a cache of economyUsers that only lives for a single request, so the economyUser of a member
+# is only fetched once no matter how many times it is needed to handle the request. Concurrent gets of
+# the same member share a single fetch.
+#
+# A prefetched fetch is only scheduled, and does not actually begin until the caller next yields to the
+# event loop. Since the work done while waiting on the fetch (such as reading the members state) is
+# synchronous, startFetch should be awaited instead so the fetch has already reached its I/O by the time
+# that work starts.
+class EconomyUserCache():
+    def __init__(self, bot):
+        self.bot = bot
+        self._users: dict = {}
+
+    def prefetch(self, member_id: int) -> asyncio.Future:
+        member_id = int(member_id)
+        if member_id not in self._users: self._users[member_id] = asyncio.ensure_future(self.bot.utils.managers.economyManager.getUser(member_id))
+        return self._users[member_id]
+
+    async def startFetch(self, member_id: int) -> None:
+        self.prefetch(member_id)
+        await asyncio.sleep(0)
+
+    async def getUser(self, member_id: int) -> Any:
+        return await self.prefetch(member_id)
+
+
+# This is a snapshot of a members shop state, holding their purchase counters and their
+# current item expiries. It is built once per request so that rendering the whole catalog
+# only reads the members state once no matter how many items there are. Any callbacks that
+# accept a 'context' keyword argument are given the snapshot when they are invoked.
+#
+# The balance is only known if whoever built the context has fetched the members economyUser,
+# otherwise it is None and minimum balance rules are not checked. The results of any availability
+# conditions are cached in the context so each is only evaluated once per request. The purchases
+# and expiries can be given directly when they have already been fetched, such as in bulk. The
+# context also carries the economyUser cache of the request, which callbacks should use instead
+# of the economyManager.
+class MemberShopContext():
+    def __init__(self, bot, member_id: Optional[int], purchases: Optional[dict] = None, expiries: Optional[dict] = None, economy_users: Optional[EconomyUserCache] = None):
+        self.member_id: Optional[int] = None if member_id is None else int(member_id)
+        self.purchases: dict = {}
+        self.expiries: dict = {}
+        self.balance: Optional[int] = None
+        self.conditions: dict = {}
+        self.economyUsers: EconomyUserCache = economy_users if economy_users is not None else EconomyUserCache(bot)
+
+        if purchases is not None or expiries is not None:
+            self.purchases = dict(purchases or {})
+            self.expiries = dict(expiries or {})
+
+        elif self.member_id is not None:
+            self.purchases = bot.utils.managers.shopManager.getMemberPurchases(self.member_id)
+            self.expiries = bot.utils.managers.shopManager.getMemberExpiries(self.member_id)
+
+
+# Checks if the given callback function is able to accept the 'context' keyword argument, either
+# directly or through a **kwargs argument.
+def _acceptsContext(callback: Callable) -> bool:
+    try: parameters = inspect.signature(callback).parameters
+    except (TypeError, ValueError): return False
+    if "context" in parameters: return True
+    return any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
+
+
+# The default callbacks of every item, from the GenericItemCallbacks class. These tables are shared by
+# every item until an event callback is added to it, at which point the item is given its own copy, so
+# the thousands of items that never add a callback do not each hold a table of their own. The empty
+# sets and mappings of the item options are shared in the same way.
+_DEFAULT_CALLBACKS = MappingProxyType({
+    "purchased": GenericItemCallbacks.purchased,
+    "expired": GenericItemCallbacks.expired
+})
+_DEFAULT_CONTEXT_CALLBACKS = frozenset(event for event, callback in _DEFAULT_CALLBACKS.items() if _acceptsContext(callback))
+_EMPTY_SET = frozenset()
+_DATA_COLUMNS = tuple(field for field in CatalogColumns.FIELDS if field != "category")
+_EMPTY_MAPPING = MappingProxyType({})
+
 class Item():
+    __slots__ = (
+        "bot", "id", "_category", "_data", "_columns", "_row", "_callbacks", "_contextCallbacks", "_dynamicFields", "_fieldTTLs", "_fieldCache",
+        "_expiry", "_limit", "group", "_exclusive", "_requiredItems", "_excludedItems", "_conditions", "_minBalance", "_lazyFilepath"
+    )
+
     def __init__(self, bot, item_id: str, category: str, data: dict):
         self.bot = bot
         self.id: str = item_id
-        self.category: str = category
+        self._category: Optional[str] = category
         self._data: dict = data
+
+        # Once the item is added to the shop its category, title, description, image and price are
+        # moved out of the item data into the catalog columns of the shopManager, at the given row.
+        # Until then (or once removed) they are held by the item itself.
+        self._columns: Optional[CatalogColumns] = None
+        self._row: Optional[int] = None
         
         # UPDATE 24/01/2022:
         #   We now supply default callbacks. These are from the GenericItemCallbacks
         #   class that provides a set of generic responses to events. Setting the default
         #   callbacks still allow for the events to be overwritten using the addEventCallback
         #   function.
-        self._callbacks: dict = {
-            "purchased": GenericItemCallbacks.purchased,
-            "expired": GenericItemCallbacks.expired
-        }
+        self._callbacks: Mapping = _DEFAULT_CALLBACKS
+
+        # This is the set of events whose callbacks accept the 'context' keyword argument,
+        # worked out once when the callback is added rather than on each invocation.
+        self._contextCallbacks: frozenset = _DEFAULT_CONTEXT_CALLBACKS
+
+        # Fields of the item data are static by default, meaning they do not depend on the member
+        # viewing the item. Their values (after any get_* event) are resolved once and then cached
+        # as (value, expires_at) until invalidated, or until their optional TTL has passed. Dynamic
+        # fields are resolved again for every member on every request.
+        self._dynamicFields: frozenset = _EMPTY_SET
+        self._fieldTTLs: Mapping = _EMPTY_MAPPING
+        self._fieldCache: dict = {}
         
         # These are optional options that modify the availablity of the item for
         # a given user. If set they should be respected over the is_available
         # event response since the item developer has explicitly imposed the limits.
         self._expiry: Optional[int] = None
         self._limit: Optional[int] = None
-    
+
+        # The group is an optional tag shared by related items, such as all of the protection items.
+        # The shopManager indexes the active (not yet expired) items of each group per member.
+        self.group: Optional[str] = None
+
+        # These are the declarative availability rules of the item. Like the limit and expiry, they
+        # are checked before the is_available event, and the shopManager compiles them so that they
+        # can be checked for every item at once without calling into the item.
+        self._exclusive: bool = False
+        self._requiredItems: frozenset = _EMPTY_SET
+        self._excludedItems: frozenset = _EMPTY_SET
+        self._conditions: frozenset = _EMPTY_SET
+        self._minBalance: Optional[int] = None
+
+        # If the item was created from the item manifest rather than by its item file, this is the
+        # filepath of the item file, which has to be loaded before any of the items events are run.
+        self._lazyFilepath: Optional[str] = None
+
+    @property
+    def category(self) -> str:
+        if self._row is None: return self._category
+        return self._columns.get("category", self._row)
+
     # This option defines the maximum amount of this item that a user is able to purchase.
     # Setting it to one would mean that the user is only allowed to purchase the given item
     # once. Note that setting the value to zero would result in the item always being unavaiable
     # to every user.
     def setPurchaseLimit(self, amount: int = 1) -> None:
         self._limit = amount
+        self.invalidateCache()
 
     # This option sets how long the item should remain active for. Once the expiry time has been
     # met the "expired" event is called on the Item with the given member_id. The value should be
@@ -59,6 +188,70 @@ class Item():
     # purchase the item as it will be marked unavaiable during expiry wait. 
     def setExpiry(self, seconds: int) -> None:
         self._expiry = seconds
+        self.invalidateCache()
+
+    # Sets the group of the item. This should be set before the item is added to the shop. It allows
+    # the shopManager to quickly answer which items of the group a member currently has active. If the
+    # item is exclusive then it is unavailable while the member has any item of the group active.
+    def setGroup(self, group: Optional[str], exclusive: bool = False) -> None:
+        self.group = group
+        self._exclusive = exclusive
+        self.invalidateCache()
+
+    # Makes the item only available to members who own the given item ID. An item is owned if it has
+    # been purchased and, if it has an expiry, has not yet expired.
+    def addRequiredItem(self, item_id: str) -> None:
+        self._requiredItems = self._requiredItems | {item_id}
+        self.invalidateCache()
+
+    # Makes the item unavailable to members who own the given item ID.
+    def addExcludedItem(self, item_id: str) -> None:
+        self._excludedItems = self._excludedItems | {item_id}
+        self.invalidateCache()
+
+    # Makes the item only available while the given condition is met. Conditions are registered by
+    # key on the shopManager using registerCondition, and can either be per member or global (such as
+    # a cooldown shared by everyone).
+    def addCondition(self, key: str) -> None:
+        self._conditions = self._conditions | {key}
+        self.invalidateCache()
+
+    # Makes the item only available to members with at least the given balance. Setting the value to
+    # None removes the minimum balance.
+    def setMinimumBalance(self, amount: Optional[int]) -> None:
+        self._minBalance = amount
+        self.invalidateCache()
+
+    # Marks a key of the item data as dynamic, meaning its get_* event depends on the member viewing
+    # the item so it should not be cached. Any get_* callback that accepts the 'context' argument is
+    # already treated as dynamic, so this is only needed for callbacks that fetch member data themselves.
+    def setDynamicField(self, key: str, dynamic: bool = True) -> None:
+        if dynamic: self._dynamicFields = self._dynamicFields | {key}
+        else: self._dynamicFields = self._dynamicFields - {key}
+        self.invalidateCache(key)
+
+    # Sets how many seconds the cached value of a static field should be used for before its get_*
+    # event is invoked again. This is useful for computed fields that change over time but do not
+    # depend on the member. Setting the value to None caches the field until it is invalidated.
+    def setFieldTTL(self, key: str, seconds: Optional[int]) -> None:
+        fieldTTLs = dict(self._fieldTTLs)
+        if seconds is None: fieldTTLs.pop(key, None)
+        else: fieldTTLs[key] = seconds
+        self._fieldTTLs = fieldTTLs
+        self.invalidateCache(key)
+
+    # Changes a value of the item data, such as the title or price, after the item has been created.
+    def setData(self, key: str, value: Any) -> None:
+        if self._row is not None and key in _DATA_COLUMNS: self._columns.set(key, self._row, value)
+        else: self._data[key] = value
+        self.invalidateCache(key)
+
+    # Removes the cached value of the given static field, or every static field if no key is given,
+    # so that it is resolved again the next time the item data is requested.
+    def invalidateCache(self, key: Optional[str] = None) -> None:
+        if key is None: self._fieldCache.clear()
+        else: self._fieldCache.pop(key, None)
+        self.bot.utils.managers.shopManager.invalidateCatalog()
 
     # This is used to cause a pre-mature expiry for a given user if they have the
     # item currently and it hasn't yet expired. The second argument determines if
@@ -67,15 +260,15 @@ class Item():
     # then activate on a different event such as a user being robbed. The value returned
     # determines if the action was successful or not.
     def manuallyExpireMemberID(self, member_id: int, executeCallback: bool = True) -> bool:
-        userExpiry = self.bot.utils.managers.stateManager.get("shop-expiry-" + str(member_id))
-        if userExpiry is None: return False
-        if self.id not in list(userExpiry.keys()): return False
+        userExpiry = self.bot.utils.managers.shopManager.getMemberExpiries(member_id)
+        if self.id not in userExpiry: return False
 
         # In this case the given member_id does have an outstanding expiry for this item set.
         # If the executeCallback argument is set we cannot do much other than marking the expiry
         # zero so the shopManager handles it instead (since the event to call is async).
         if executeCallback:
-            userExpiry[self.id] = 0    
+            userExpiry[self.id] = 0
+            self.bot.utils.managers.shopManager.scheduleExpiry(member_id, self.id, 0)
 
         else:
             # If we're not executing the callback, we can just pop the expiry key from the users
@@ -83,138 +276,800 @@ class Item():
             # the shopManager task to catch up.
             userExpiry.pop(self.id, None)
         
-        self.bot.utils.managers.stateManager.set("shop-expiry-" + str(member_id), userExpiry)
+        self.bot.utils.managers.shopManager.setMemberExpiries(member_id, userExpiry)
         return True
 
-    def getData(self, member_id: Optional[int] = None) -> dict:
-        
-        # We also now iterate through all the data given to check if there are
-        # any events registered to modify the given value before its sent out.
+    # Gets the data of the item as it should be shown to the given member_id. If a MemberShopContext
+    # is not given then one is built, however when getting the data of multiple items for the same
+    # member the context should be built once and passed in to each call.
+    def getData(self, member_id: Optional[int] = None, context: Optional[MemberShopContext] = None) -> dict:
+        with Timer(self.bot.utils.managers.shopManager._getDataSeconds):
+            if context is None: context = MemberShopContext(self.bot, member_id)
+
+            itemData = self.getStaticData()
+            itemData.update(self.getDynamicData(context))
+            itemData["available"] = self.isAvailable(member_id, context)
+            return itemData
+
+    # Gets the part of the item data that is the same for every member. The availability of the
+    # item is not included since it always depends on the member.
+    def getStaticData(self) -> dict:
         itemData = {"id": self.id}
-        for k in list(self._data.keys()):
-            v = self._invokeEvent("get_" + k, self)
-            if v is None: v = self._data[k]
+        for k in self._getFieldKeys():
+            if k == "available" or self._isDynamicField(k): continue
+            itemData[k] = self._getStaticField(k)
+
+        # If the badges key is None then it was set during the createItem function.
+        # The website does not like when this key is null, and instead checks if the
+        # key even exists. For this reason if the badges key is None we should delete it.
+        if "badges" in itemData and itemData["badges"] is None: del itemData["badges"]
+
+        return itemData
+
+    # Gets the part of the item data that has to be resolved for each member, which are the fields
+    # marked as dynamic. Most items have no dynamic fields, in which case this is empty.
+    def getDynamicData(self, context: MemberShopContext) -> dict:
+        itemData = {}
+        for k in self._getFieldKeys():
+            if k == "available" or not self._isDynamicField(k): continue
+
+            # We iterate through the dynamic data to check if there are any events
+            # registered to modify the given value before its sent out.
+            v = self._invokeEvent("get_" + k, self, context=context)
+            if v is None: v = self._getField(k)
             itemData[k] = v
 
-        # This is the default value which marks that the item has not yet determined
-        # is availability. Before the JSON is returned this value will become boolean.
-        isAvailable: Optional[bool] = None
+        if "badges" in itemData and itemData["badges"] is None: del itemData["badges"]
+        return itemData
+
+    # Determines if the item can currently be purchased by the given member_id.
+    def isAvailable(self, member_id: Optional[int], context: Optional[MemberShopContext] = None) -> bool:
+        if context is None: context = MemberShopContext(self.bot, member_id)
+        if not self._passesRules(context): return False
+        return self._resolveAvailable(member_id, context)
+
+    # Checks the limit, expiry and declarative rules of the item against the context. This is the same
+    # check that the shopManager does for every item at once using the compiled rules.
+    def _passesRules(self, context: MemberShopContext) -> bool:
+        shopManager = self.bot.utils.managers.shopManager
 
         # First check to see if the user has already reached the limit of this item
         # that can be purchased. (If the limiter is enabled).
         if self._limit is not None:
-            userPurchaseCounter = self.bot.utils.managers.stateManager.get("shop-purchases-" + str(member_id))
-            if userPurchaseCounter is None: userPurchaseCounter = {}
-            if self.id not in list(userPurchaseCounter.keys()): userPurchaseCounter[self.id] = 0
-            if userPurchaseCounter[self.id] >= self._limit: isAvailable = False
+            if context.purchases.get(self.id, 0) >= self._limit: return False
 
         # Next, if this item has a set expiry we should check to see if the given
         # member_id is assosiated with any existing expiry for this item ID.
         if self._expiry is not None:
-            userExpiries = self.bot.utils.managers.stateManager.get("shop-expiry-" + str(member_id))
-            if userExpiries is None: userExpiries = {}
-            if self.id in list(userExpiries.keys()): isAvailable = False
+            if self.id in context.expiries: return False
+
+        if self._exclusive and shopManager.hasActiveGroupItem(context.member_id, self.group, context): return False
+        if any(not shopManager.isItemOwned(item_id, context) for item_id in self._requiredItems): return False
+        if any(shopManager.isItemOwned(item_id, context) for item_id in self._excludedItems): return False
+        if any(not shopManager.evaluateCondition(key, context) for key in self._conditions): return False
+        if self._minBalance is not None and context.balance is not None and context.balance < self._minBalance: return False
+        return True
+
+    # Works out the availability of the item from its is_available event or its available key, once
+    # the rules have passed. This is the fallback for anything that cannot be expressed as a rule.
+    def _resolveAvailable(self, member_id: Optional[int], context: MemberShopContext) -> bool:
 
         # If we have not yet determined a value for the avaiable key, we should try
         # to invoke the is_available event on the item to get the value that way. If
-        # that fails and there is still no available key, we should just default the
-        # item to being unavailable.
-        if isAvailable is None:
-            isAvailable = self._invokeEvent("is_available", member_id, self)
-            if isAvailable in [True, False]: itemData["available"] = isAvailable
-            if "available" not in itemData: itemData["available"] = False
-        
-        else:
-            # If we've already determined an availability state for the item just use
-            # that value instead.
-            itemData["available"] = isAvailable
+        # that fails we fall back to the available key of the item data, and if there
+        # is no available key we should just default the item to being unavailable.
+        isAvailable = self._invokeEvent("is_available", member_id, self, context=context)
+        if isAvailable in [True, False]: return isAvailable
+        if not self._hasField("available"): return False
+        if not self._isDynamicField("available"): return self._getStaticField("available")
+        isAvailable = self._invokeEvent("get_available", self, context=context)
+        return self._getField("available") if isAvailable is None else isAvailable
 
-        # If the badges key is None then it was set during the createItem function.
-        # The website does not like when this key is null, and instead checks if the
-        # key even exists. For this reason if the badges key is None we should delete it.
-        if itemData["badges"] is None: del itemData["badges"]
+    def _isDynamicField(self, key: str) -> bool:
+        return key in self._dynamicFields or ("get_" + key) in self._contextCallbacks
 
-        return itemData
+    # Gets the keys of the item data, whether they are held in the catalog columns or by the item.
+    def _getFieldKeys(self) -> list:
+        if self._row is None: return list(self._data)
+        return [field for field in _DATA_COLUMNS if self._columns.get(field, self._row) is not MISSING] + list(self._data)
+
+    def _hasField(self, key: str) -> bool:
+        if self._row is not None and key in _DATA_COLUMNS: return self._columns.get(key, self._row) is not MISSING
+        return key in self._data
+
+    # Gets the raw value of a key of the item data, without invoking its get_* event.
+    def _getField(self, key: str) -> Any:
+        if self._row is None or key not in _DATA_COLUMNS: return self._data[key]
+        value = self._columns.get(key, self._row)
+        if value is MISSING: raise KeyError(key)
+        return value
+
+    # Moves the category and catalog fields of the item into a row of the given catalog columns. This
+    # is done by the shopManager when the item is added to the shop.
+    def _attachColumns(self, columns: CatalogColumns) -> None:
+        if self._row is not None: return
+        fields = {field: self._data.pop(field) for field in _DATA_COLUMNS if field in self._data}
+        fields["category"] = self._category
+        self._row = columns.allocate(fields)
+        self._columns = columns
+        self._category = None
+
+    # Moves the fields of the item back out of the catalog columns, freeing its row. This is done by
+    # the shopManager when the item is removed from the shop, so the item can still be used.
+    def _detachColumns(self) -> None:
+        if self._row is None: return
+        fields = self._columns.release(self._row)
+        self._category = fields.pop("category", None)
+        self._data = {**fields, **self._data}
+        self._columns = None
+        self._row = None
+
+    # Gets the value of a static field, using the cached value if there is one and it has not
+    # expired. Otherwise the get_* event is invoked without any member context and then cached.
+    def _getStaticField(self, key: str) -> Any:
+        # A field without a get_* event is just its raw value, so there is nothing worth caching.
+        if ("get_" + key) not in self._callbacks: return self._getField(key)
+
+        cached = self._fieldCache.get(key)
+        if cached is not None and (cached[1] is None or cached[1] > time.time()): return cached[0]
+
+        value = self._invokeEvent("get_" + key, self)
+        if value is None: value = self._getField(key)
+
+        ttl = self._fieldTTLs.get(key)
+        self._fieldCache[key] = (value, None if ttl is None else time.time() + ttl)
+        return value
 
     # This is used to attach an event string to a callable function. The Item does not support
     # multiple callbacks assigned to a single event, instead the callback may call further callbacks
     # if needed. Events can be found in the events.txt file.
     def addEventCallback(self, event: str, callback: Callable) -> None:
-        self._callbacks[event] = callback
+        self._callbacks = {**self._callbacks, event: callback}
+        if _acceptsContext(callback): self._contextCallbacks = self._contextCallbacks | {event}
+        else: self._contextCallbacks = self._contextCallbacks - {event}
+
+        # If the event changes the value of a field then any cached value is nolonger valid. The
+        # compiled availability rules also need to know which items have an is_available event.
+        if event.startswith("get_"): self.invalidateCache(event[len("get_"):])
+        elif event == "is_available": self.bot.utils.managers.shopManager.invalidateCatalog()
 
     # This is a primarily internal function to invoke a given event on an item, calling any assosiated
     # callbacks with it. This function does NOT support async callbacks, so None will be returned in place
-    # of a failed execution. For async callbacks use _asyncInvokeEvent.
-    def _invokeEvent(self, event: str, *args) -> Any:
-        if event not in list(self._callbacks.keys()): return None
-        if inspect.iscoroutinefunction(self._callbacks[event]): return None
-        return self._callbacks[event](self.bot, *args) 
+    # of a failed execution. For async callbacks use _asyncInvokeEvent. The context is only passed on to
+    # callbacks that accept it.
+    def _invokeEvent(self, event: str, *args, context: Optional[MemberShopContext] = None) -> Any:
+        callback = self._callbacks.get(event)
+        if callback is None: return None
+        if inspect.iscoroutinefunction(callback): return None
+
+        started = time.perf_counter(); failed = True
+        try:
+            if context is not None and event in self._contextCallbacks: result = callback(self.bot, *args, context=context)
+            else: result = callback(self.bot, *args)
+            failed = False
+            return result
+
+        finally:
+            self.bot.utils.managers.shopManager._recordEvent(self, event, callback, time.perf_counter() - started, failed)
 
     # This is simply the _invokeEvent function however async functions are supported. This function therefore
     # supports any form of callback function type, making it best for API internal calls.
-    async def _asyncInvokeEvent(self, event: str, *args) -> Any:
-        if event not in list(self._callbacks.keys()): return None
-        if inspect.iscoroutinefunction(self._callbacks[event]): return await self._callbacks[event](self.bot, *args)
-        return self._callbacks[event](self.bot, *args)
+    async def _asyncInvokeEvent(self, event: str, *args, context: Optional[MemberShopContext] = None) -> Any:
+        callback = self._callbacks.get(event)
+        if callback is None: return None
+
+        started = time.perf_counter(); failed = True
+        try:
+            if context is not None and event in self._contextCallbacks: result = callback(self.bot, *args, context=context)
+            else: result = callback(self.bot, *args)
+            if inspect.isawaitable(result): result = await result
+            failed = False
+            return result
+
+        finally:
+            self.bot.utils.managers.shopManager._recordEvent(self, event, callback, time.perf_counter() - started, failed)
 
     # This function is a direct function to attempt to make a given member_id purchase the given item. If the
     # purchase was successful the return values will be: True, None. This represents a successful execution
     # without error. If the purchase fails for any reason, then the return values will be: False, "Error Reason".
-    async def purchase(self, member_id: int) -> Tuple[bool, Optional[str]]:
-        
-        # First when a user attempts to purchase an item we should make sure that it is still available to them.
-        member_data = self.getData(member_id)
-        if not member_data["available"]:
-            return False, "Item is unavailable."
-        
-        # Next, we should get a reference to the given member's economyUser. This allows us to then check the
-        # users balance to ensure that they can actually afford the item currently.
-        ecoUser = await self.bot.utils.managers.economyManager.getUser(member_id)
-        if ecoUser is None: return False, "Failed to find member in Discord Server."
-        if member_data["price"] > int(ecoUser): return False, "Member cannot afford item."
-
-        # Finally, we actually complete the transaction and then add the purchase to the member ID's purchase
-        # counter for the limiter system to work correctly.
-        ecoUser.transaction(-member_data["price"], "Purchased '" + member_data["title"] + "' from shop.")
-        userPurchaseCounter = self.bot.utils.managers.stateManager.get("shop-purchases-" + str(member_id))
-        if userPurchaseCounter is None: userPurchaseCounter = {}
-        if self.id not in list(userPurchaseCounter.keys()): userPurchaseCounter[self.id] = 0
-        userPurchaseCounter[self.id] = userPurchaseCounter[self.id] + 1
-        self.bot.utils.managers.stateManager.set("shop-purchases-" + str(member_id), userPurchaseCounter)
-
-        # Invoke the purchased event on the item with the given user, gathered from the economyUser's internal
-        # userObject reference, so the item can execute any callbacks such as sending a message to the user etc.
-        await self._asyncInvokeEvent("purchased", ecoUser.userObject, self)
-
-        # If the item expires over time add the expiry data to the members shop data.
-        if self._expiry is not None:
-            userExpiry = self.bot.utils.managers.stateManager.get("shop-expiry-" + str(member_id))
-            if userExpiry is None: userExpiry = {}
-            userExpiry[self.id] = int(time.time()) + self._expiry
-            self.bot.utils.managers.stateManager.set("shop-expiry-" + str(member_id), userExpiry)
-        
-        return True, None
+    async def purchase(self, member_id: int, economy_users: Optional[EconomyUserCache] = None) -> Tuple[bool, Optional[str]]:
+        success, results = await self.bot.utils.managers.shopManager.purchaseItems(member_id, [self.id], economy_users=economy_users)
+        return success, results[0]["reason"]
+
+    # Applies a purchase of this item to the given members context, adding to their purchase counter and
+    # setting the expiry if the item has one. This only modifies the snapshot, it is up to the shopManager
+    # to commit it to the members state.
+    def _applyPurchase(self, context: MemberShopContext) -> None:
+        context.purchases[self.id] = context.purchases.get(self.id, 0) + 1
+        if self._expiry is not None: context.expiries[self.id] = int(time.time()) + self._expiry
+
+# These are the rate limits of the API routes used when none are configured, see config.example.py.
+__DEFAULT_RATE_LIMITS__ = {
+    "view": {"rate": 2, "burst": 20},
+    "search": {"rate": 5, "burst": 30},
+    "purchase": {"rate": 2, "burst": 10},
+    "cart": {"rate": 1, "burst": 5},
+    "get_request_id": {"rate": 1, "burst": 5}
+}
+__DEFAULT_GLOBAL_RATE_LIMITS__ = {
+    "get_request_id": {"rate": 100, "burst": 200}
+}
 
 class shopManager():
     def __init__(self, bot):
         self.bot = bot
-        self._requestIDs = {}
         self._allItems = []
         self._categorySubtitles = {}
+        config = self.bot.config.json["plugins"]["webshop"]
+
+        # The metrics record where the time is spent in the shop, and are served in the Prometheus text
+        # format by the metrics route. If the slow callback threshold is set, any event callback that takes
+        # longer than it (in seconds) is logged along with the module it belongs to.
+        self.metrics = MetricsRegistry()
+        self._requestSeconds = self.metrics.histogram("webshop_request_seconds", "Time taken to handle each API route.", ("route",))
+        self._requests = self.metrics.counter("webshop_requests_total", "API requests handled, by route and response status.", ("route", "status"))
+        self._getDataSeconds = self.metrics.histogram("webshop_item_get_data_seconds", "Time taken to build the data of a single item.")
+        self._eventSeconds = self.metrics.histogram("webshop_event_seconds", "Time taken by item event callbacks.", ("event", "item"))
+        self._eventErrors = self.metrics.counter("webshop_event_errors_total", "Item event callbacks that raised an exception.", ("event", "item"))
+        self._purchasePhaseSeconds = self.metrics.histogram("webshop_purchase_phase_seconds", "Time taken by each phase of a purchase.", ("phase",))
+        self._purchases = self.metrics.counter("webshop_purchases_total", "Purchases attempted, by result.", ("result",))
+        self._expiryTickSeconds = self.metrics.histogram("webshop_expiry_tick_seconds", "Time taken to process each batch of due expiries.")
+        self._expiries = self.metrics.counter("webshop_expiries_processed_total", "Due expiries processed by the expiry task.")
+        self.metrics.gauge("webshop_pending_expiries", "Entries in the expiry queue.", lambda: len(self._expiryQueue))
+        self.metrics.gauge("webshop_pending_side_effects", "Events waiting for a side effect worker.", lambda: self._sideEffectQueue.qsize())
+        self.metrics.gauge("webshop_pending_expired_events", "Expired events waiting for an expiry worker.", lambda: self._expiredQueue.qsize())
+        self.metrics.gauge("webshop_dead_letters", "Events that failed after all of their retries.", lambda: len(self._deadLetters))
+        self._slowCallbackThreshold: Optional[float] = config.get("slow_callback_threshold", None)
+
+        # These are indexes over the items so that the lookups used on every request do not
+        # have to scan every item. They must be kept consistent with _allItems, which is done
+        # by addItem.
+        self._itemsByID: dict = {}
+        self._itemsByCategory: dict = {}
+        self._itemsByGroup: dict = {}
+
+        # The category and catalog fields of every item in the shop are held in these columns rather
+        # than by each item, which keeps large catalogs compact. Items are given a row once added.
+        self._catalogColumns = CatalogColumns()
+
+        # This is an inverted index of the active (not yet expired) items. It holds the active item
+        # IDs of each member, the members that have each item active, and for each group the active
+        # item IDs of each member. It is loaded along with the expiry queue and then kept up to date
+        # whenever a members expiries are set.
+        self._activeIndexLoaded: bool = False
+        self._activeItems: dict = {}
+        self._activeByItem: dict = {}
+        self._activeByGroup: dict = {}
+
+        # Each item file that has been loaded is tracked as filepath -> registration, where the
+        # registration holds everything the file added to the shop (items, category subtitles,
+        # conditions and hook listeners). This allows a single file to be reloaded by swapping out
+        # only what it registered. While a file is being set up its registrations are collected in
+        # _loadingFile instead of being applied, so they can all be applied at once.
+        self._itemFiles: dict = {}
+        self._itemFileMTimes: dict = {}
+        self._loadingFile: Optional[dict] = None
+
+        # The request codes issued to members are kept in a bounded store that expires old codes
+        # and persists them to a log file, so shop links keep working after a restart. Alternatively
+        # in the signed mode, the codes are signed tokens which do not need to be stored at all.
+        if config.get("request_code_mode", "table") == "signed":
+            self._requestCodes = SignedRequestTokens(
+                keys=config["request_code_keys"],
+                signing_key=config["request_code_signing_key"],
+                ttl=config.get("request_code_ttl", 3600 * 24 * 30)
+            )
+
+        else:
+            self._requestCodes = RequestCodeStore(
+                filepath=self._getDataPath(config.get("request_code_store", "plugins/webshop/request_codes.log")),
+                ttl=config.get("request_code_ttl", 3600 * 24 * 30),
+                max_codes=config.get("request_code_limit", 100000)
+            )
+
+        # The API routes are rate limited by request code and by member, with an optional global limit
+        # per route, using token buckets given as route -> {"rate": per_second, "burst": tokens}. The
+        # buckets of every route share a single fixed size limiter.
+        self._rateLimiter = RateLimiter(config.get("rate_limit_buckets", 100000))
+        self._rateLimits: dict = config.get("rate_limits", __DEFAULT_RATE_LIMITS__)
+        self._globalRateLimits: dict = config.get("global_rate_limits", __DEFAULT_GLOBAL_RATE_LIMITS__)
+
+        # The catalog is the part of the view response that is the same for every member. It is
+        # serialized once and cached as (version, expires_at, json, etag) until the catalog version
+        # changes, which happens whenever an item or category subtitle is added or modified.
+        self._catalogVersion: int = 0
+        self._catalogCache: Optional[tuple] = None
+
+        # The state version of a member is increased whenever their purchases or expiries are set, so
+        # the view of a member can be versioned without building it. The epoch is random for each run,
+        # since the versions are only kept in memory and start again after a restart. The catalog is
+        # only versionable if nothing in it is resolved by a callback, which is cached as (version, bool).
+        self._memberStateVersions: dict = {}
+        self._stateEpoch: str = os.urandom(4).hex()
+        self._viewVersionable: Optional[tuple] = None
+
+        # The declarative availability rules of every item are compiled for the same catalog version,
+        # and the conditions they use are registered here as key -> (callback, per_member).
+        self._compiledRules: Optional[CompiledAvailabilityRules] = None
+        self._searchIndex: Optional[CatalogSearchIndex] = None
+
+        # The items with any dynamic fields are the only items that add to the members overlay, so they
+        # are found once for each catalog version and cached as (version, items).
+        self._dynamicItems: Optional[tuple] = None
+        self._conditions: dict = {}
+
+        # Each member has a lock which is held while one of their purchases is being checked and
+        # committed. The locks are only kept while something is holding or waiting on them.
+        self._memberLocks = weakref.WeakValueDictionary()
+
+        # The members shop state is kept in the shop storage, which is an SQLite database by default.
+        # Any state from before the database was used is migrated from the stateManager once.
+        if config.get("storage_backend", "sqlite") == "state":
+            self._storage = StateManagerStorage(self.bot)
+
+        else:
+            self._storage = SQLiteStorage(self._getDataPath(config.get("storage_path", "plugins/webshop/shop.db")))
+            migratedMembers = self._storage.migrateFromStateManager(self.bot)
+            if migratedMembers > 0: self.bot.log("Migrated the shop state of " + str(migratedMembers) + " stateManager keys into the shop storage.")
+
+        # Every write to the members shop state goes through the write-behind buffer, which coalesces
+        # writes per member and flushes them to the shop storage in batches. Setting the interval to
+        # zero writes every change straight through.
+        self._stateFlushInterval: float = config.get("state_flush_interval", 1)
+        self._state = WriteBehindBuffer(
+            read=self._storage.get,
+            write_batch=self._storage.writeBatch,
+            read_many=self._storage.getMany,
+            max_pending=config.get("state_flush_size", 500) if self._stateFlushInterval > 0 else 1
+        )
+
+        # The expiry queue is a min-heap of (expires_at, member_id, item_id) tuples. It is
+        # built once from the shop storage when the expiry task starts and is then kept up
+        # to date by the Item whenever an expiry is added or changed. Entries are never removed
+        # early, instead they are checked against the members state when they are popped.
+        self._expiryQueue: list = []
+        self._expiryQueueWakeup = asyncio.Event()
+
+        # Due expiries are removed from the members state in batches of up to this size. Their expired
+        # events are queued as (member_id, item_id) and run by a separate pool of expiry workers, so the
+        # amount run at once is bounded without the expiry task ever waiting for them to finish.
+        self._expiryBatchSize: int = config.get("expiry_batch_size", 500)
+        self._expiredQueue = asyncio.Queue()
+        self._lockedExpiryTasks: set = set()
+
+        # Side effects are the purchased and expired events, which usually send messages or modify
+        # roles in Discord. They are queued and run by a pool of workers instead of being awaited by
+        # the purchase or expiry that caused them. Events that still fail after all of their retries
+        # are logged and kept in the dead letters for inspection.
+        self._sideEffectQueue = asyncio.Queue()
+        self._sideEffectRetries: int = config.get("side_effect_retries", 3)
+        self._sideEffectRetryDelay: float = config.get("side_effect_retry_delay", 2)
+        self._sideEffectTimeout: Optional[float] = config.get("side_effect_timeout", 30)
+        self._deadLetters = collections.deque(maxlen=100)
+
+        # If set, the item files are checked for changes on this interval and reloaded individually.
+        self._itemReloadInterval: float = config.get("item_reload_interval", 0)
+
+        # When lazy item loading is enabled, the items of any item file that only uses simple callbacks
+        # are recorded in the item manifest, so that on the next startup the file does not need to be
+        # imported until one of its items is purchased or expires.
+        self._lazyItemLoading: bool = config.get("lazy_item_loading", False)
+        self._itemManifestPath: Optional[str] = self._getDataPath(config.get("item_manifest", "plugins/webshop/item_manifest.json"))
+        self._itemManifest: dict = {}
+        self._itemManifestChanged: bool = False
         
         # Create the task to check for expired items and then assosiate it with the
-        # webshop plugin incase the plugin is reloaded or unloaded alltogether.
+        # webshop plugin incase the plugin is reloaded or unloaded alltogether. The same
+        # is done for each of the side effect workers.
         self.bot.create_task(self._item_expiry_task(), "webshop")
+        if self._stateFlushInterval > 0: self.bot.create_task(self._state_flush_task(), "webshop")
+        if self._itemReloadInterval > 0: self.bot.create_task(self._item_reload_task(), "webshop")
+        for _ in range(config.get("side_effect_workers", 4)):
+            self.bot.create_task(self._side_effect_worker(), "webshop")
+        for _ in range(config.get("expiry_workers", 8)):
+            self.bot.create_task(self._expiry_worker(), "webshop")
     
     def setCategorySubtitle(self, category: str, text: str) -> None:
+        if self._loadingFile is not None: self._loadingFile["subtitles"][category] = text; return
         self._categorySubtitles[category] = text
+        self.invalidateCatalog()
 
-    def getCategoriesForMemberID(self, member_id: int) -> dict:
-        categories = {}
+    # Adds a listener to a hook of the hookManager. Item files should use this instead of adding the
+    # listener directly, so that the listener is replaced rather than duplicated when the file is reloaded.
+    def addHookListener(self, hook: str, callback: Callable) -> None:
+        if self._loadingFile is not None: self._loadingFile["hooks"].append((hook, callback)); return
+        self.bot.utils.managers.hookManager.addListener(hook, callback)
+
+    # Marks the serialized catalog as outdated so that it is rebuilt on the next request. This is
+    # called automatically when items or subtitles change.
+    def invalidateCatalog(self) -> None:
+        self._catalogVersion += 1
+
+    # Gets the catalog serialized as a JSON object, along with an ETag for it. The catalog contains
+    # the shop information from the config, the category subtitles and the static data of every
+    # item, so it only has to be rebuilt when one of those change (or a cached field's TTL ends).
+    def getCatalogJSON(self) -> Tuple[bytes, str]:
+        cache = self._catalogCache
+        if cache is not None and cache[0] == self._catalogVersion and (cache[1] is None or cache[1] > time.time()):
+            return cache[2], cache[3]
+
+        version = self._catalogVersion
+        config = self.bot.config.json["plugins"]["webshop"]
+        catalog = {
+            "title": config["web_title"],
+            "currency_symbol": config["web_currency_symbol"],
+            "description": config["web_description"],
+            "categories": {category: [item.getStaticData() for item in items] for category, items in self._itemsByCategory.items()},
+            "category_subtitles": self._categorySubtitles
+        }
+        catalogJSON = json.dumps(catalog, separators=(",", ":")).encode()
+
+        # If any static field was cached with a TTL then the catalog must also be rebuilt once the
+        # earliest of those has expired, so the new field value is used.
+        expiresAt = None
         for item in self._allItems:
-            if item.category not in list(categories.keys()):
-                categories[item.category] = []
-            categories[item.category].append(item.getData(member_id))
+            for cached in item._fieldCache.values():
+                if cached[1] is not None and (expiresAt is None or cached[1] < expiresAt): expiresAt = cached[1]
+
+        self._catalogCache = (version, expiresAt, catalogJSON, hashlib.blake2b(catalogJSON, digest_size=8).hexdigest())
+        return self._catalogCache[2], self._catalogCache[3]
+
+    # Gets the part of the view response that depends on the member. This is the list of item IDs
+    # available to the member and the values of any dynamic fields, keyed by the item ID.
+    def getMemberOverlay(self, member_id: int, context: Optional[MemberShopContext] = None) -> dict:
+        if context is None: context = self.getMemberContext(member_id)
+
+        overrides = {}
+        for item in self._getDynamicItems():
+            dynamicData = item.getDynamicData(context)
+            if len(dynamicData) > 0: overrides[item.id] = dynamicData
+
+        return {"available": self.getAvailableItemIDs(member_id, context), "item_overrides": overrides}
+
+    # Gets an ETag for the view of the member without building it, from the catalog version, the members
+    # state version, their balance and the results of any conditions. This is only possible when every
+    # item is available purely by its declarative rules and has no dynamic or TTL cached fields, since
+    # anything else is decided by callbacks that could change at any time. Otherwise None is returned,
+    # and the ETag has to be worked out from the view itself.
+    def getViewETag(self, context: MemberShopContext) -> Optional[str]:
+        rules = self._getCompiledRules()
+        if self._viewVersionable is None or self._viewVersionable[0] != self._catalogVersion:
+            versionable = len(rules.fallbackItems) == 0 and not any(item._isDynamicField(k) or k in item._fieldTTLs for item in self._allItems for k in item._getFieldKeys())
+            self._viewVersionable = (self._catalogVersion, versionable)
+        if not self._viewVersionable[1]: return None
+
+        conditions = "".join(["1" if self.evaluateCondition(key, context) else "0" for key in sorted(rules.conditions)])
+        version = [self._stateEpoch, self._catalogVersion, self._memberStateVersions.get(context.member_id, 0), context.balance, conditions]
+        return 'W/"' + hashlib.blake2b(repr(version).encode(), digest_size=8).hexdigest() + '"'
+
+    # Gets the IDs of every item available to the member, in the order the items were added. The
+    # declarative rules of every item are checked at once using the compiled rules, and only the items
+    # that pass and have an is_available or get_available event have to be checked individually.
+    def getAvailableItemIDs(self, member_id: int, context: Optional[MemberShopContext] = None) -> list:
+        if context is None: context = self.getMemberContext(member_id)
+        rules = self._getCompiledRules()
+        return rules.getItemIDs(self._getAvailableMask(rules, context))
+
+    # Searches the items of the shop for the given member, returning a page of their item data in the
+    # order of the catalog. Every filter is optional: the category, a price range, words that must be in
+    # the title or description, only items the member can afford (which needs the context balance) and
+    # only items that are available. The cursor is the item ID the previous page ended on, and the ID
+    # to use for the next page is returned as the next_cursor, which is None on the last page:
+    #   {"items": [...], "next_cursor": Optional[str]}
+    def searchItems(
+        self,
+        member_id: int,
+        context: Optional[MemberShopContext] = None,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        text: Optional[str] = None,
+        affordable: bool = False,
+        available: bool = False,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> dict:
+        if context is None: context = self.getMemberContext(member_id)
+        if affordable and context.balance is not None: max_price = context.balance if max_price is None else min(max_price, context.balance)
+
+        index = self._getSearchIndex(); rules = self._getCompiledRules()
+        candidates = set(range(len(index.items)))
+        if category is not None: candidates &= index.categories.get(category, set())
+        if min_price is not None or max_price is not None: candidates &= index.getPriceRange(min_price, max_price)
+        if text: candidates &= index.getTextMatches(text)
+
+        start = 0 if cursor is None else index.positions[cursor] + 1
+        availableMask = self._getAvailableMask(rules, context)
+        queryTokens = tokenize(text) if text else []
+
+        results = []
+        for position in sorted(candidates):
+            if position < start: continue
+            item = index.items[position]
+            if available and not availableMask & rules.bits[item.id]: continue
+
+            itemData = item.getStaticData()
+            itemData.update(item.getDynamicData(context))
+            itemData["available"] = bool(availableMask & rules.bits[item.id])
+
+            # Items that could not be indexed are checked against their values for this member.
+            if position in index.unindexedPrices and (min_price is not None or max_price is not None):
+                price = itemData.get("price")
+                if not isinstance(price, (int, float)) or (min_price is not None and price < min_price) or (max_price is not None and price > max_price): continue
+
+            if position in index.unindexedText and len(queryTokens) > 0:
+                itemTokens = tokenize(" ".join([str(itemData[key]) for key in ["title", "description"] if key in itemData]))
+                if not all(any(queryToken in itemToken for itemToken in itemTokens) for queryToken in queryTokens): continue
+
+            if len(results) == limit: return {"items": results, "next_cursor": results[-1]["id"]}
+            results.append(itemData)
+
+        return {"items": results, "next_cursor": None}
+
+    def _getAvailableMask(self, rules: CompiledAvailabilityRules, context: MemberShopContext) -> int:
+        owned = set(context.expiries)
+        for item_id, count in context.purchases.items():
+            if count > 0 and item_id not in rules.expiring: owned.add(item_id)
+
+        available = rules.allMask & ~rules.getBlockedMask(context, owned, self.evaluateCondition)
+        for bit, item in rules.fallbackItems:
+            if available & bit and not item._resolveAvailable(context.member_id, context): available &= ~bit
+
+        return available
+
+    # Works out which items each of the given members can purchase and afford, for uses such as admin
+    # dashboards and notifying members of items they can now afford. The state of every member is read
+    # in bulk and their balances are fetched concurrently. The result is a matrix with a row of booleans
+    # per member, where each column is the item of the same index in 'item_ids':
+    #   {"item_ids": [...], "members": {member_id: {"balance": int, "available": [...], "affordable": [...]}}}
+    # An item is affordable if it is available and its price is no more than the members balance.
+    # Members that cannot be found by the economyManager are left out.
+    async def getAvailabilityMatrix(self, member_ids: list) -> dict:
+        member_ids = list(dict.fromkeys(int(member_id) for member_id in member_ids))
+        ecoUsers = await asyncio.gather(*[self.bot.utils.managers.economyManager.getUser(member_id) for member_id in member_ids])
+        contexts = self.getMemberContexts(member_ids)
+        rules = self._getCompiledRules()
+
+        # Global conditions are the same for every member, so they are only evaluated once and then
+        # given to every context.
+        globalConditions = {}
+        for key in rules.conditions:
+            condition = self._conditions.get(key)
+            if condition is not None and not condition[1]: globalConditions[key] = bool(condition[0](self.bot))
+
+        # The items are sorted by their static price, so the items a balance can afford are found by a
+        # single lookup of the cumulative masks. Items with a dynamic price are checked per member.
+        prices = {}; dynamicPrices = []
+        for item in rules.items:
+            if item._isDynamicField("price"): dynamicPrices.append((rules.bits[item.id], item)); continue
+            price = item._getStaticField("price")
+            prices[price] = prices.get(price, 0) | rules.bits[item.id]
+        sortedPrices = sorted(prices)
+        priceMasks = [0] * (len(sortedPrices) + 1)
+        for index, price in enumerate(sortedPrices): priceMasks[index + 1] = priceMasks[index] | prices[price]
+
+        members = {}
+        for member_id, ecoUser in zip(member_ids, ecoUsers):
+            if ecoUser is None: continue
+            context = contexts[member_id]
+            context.balance = int(ecoUser)
+            context.conditions.update(globalConditions)
+
+            available = self._getAvailableMask(rules, context)
+            affordable = available & priceMasks[bisect.bisect_right(sortedPrices, context.balance)]
+            for bit, item in dynamicPrices:
+                if available & bit and item.getDynamicData(context).get("price", 0) <= context.balance: affordable |= bit
+
+            members[member_id] = {
+                "balance": context.balance,
+                "available": [bool(available & rules.bits[item.id]) for item in rules.items],
+                "affordable": [bool(affordable & rules.bits[item.id]) for item in rules.items]
+            }
+
+        return {"item_ids": [item.id for item in rules.items], "members": members}
+
+    def _getCompiledRules(self) -> CompiledAvailabilityRules:
+        if self._compiledRules is None or self._compiledRules.version != self._catalogVersion:
+            self._compiledRules = CompiledAvailabilityRules(self._allItems, self._catalogVersion)
+        return self._compiledRules
+
+    def _getDynamicItems(self) -> list:
+        if self._dynamicItems is None or self._dynamicItems[0] != self._catalogVersion:
+            self._dynamicItems = (self._catalogVersion, [item for item in self._allItems if any(k != "available" and item._isDynamicField(k) for k in item._getFieldKeys())])
+        return self._dynamicItems[1]
+
+    def _getSearchIndex(self) -> CatalogSearchIndex:
+        if self._searchIndex is None or self._searchIndex.version != self._catalogVersion:
+            self._searchIndex = CatalogSearchIndex(self._allItems, self._catalogVersion)
+        return self._searchIndex
+
+    # Registers a condition that items can require with item.addCondition. A per member condition is
+    # called as callback(bot, member_id) and a global condition as callback(bot), returning whether the
+    # condition is met. Registering a condition with an existing key replaces it.
+    def registerCondition(self, key: str, callback: Callable, per_member: bool = True) -> None:
+        if self._loadingFile is not None: self._loadingFile["conditions"][key] = (callback, per_member); return
+        self._conditions[key] = (callback, per_member)
+
+    # Evaluates the given condition for the member of the context. The result is cached in the context
+    # so that each condition is only evaluated once, no matter how many items use it. Conditions that
+    # have not been registered are never met.
+    def evaluateCondition(self, key: str, context: MemberShopContext) -> bool:
+        if key in context.conditions: return context.conditions[key]
+
+        condition = self._conditions.get(key)
+        if condition is None: result = False
+        elif condition[1]: result = bool(condition[0](self.bot, context.member_id))
+        else: result = bool(condition[0](self.bot))
+
+        context.conditions[key] = result
+        return result
+
+    # Checks if the member of the context owns the given item ID, which is when they have purchased it
+    # and, if the item has an expiry, it has not yet expired.
+    def isItemOwned(self, item_id: str, context: MemberShopContext) -> bool:
+        if item_id in context.expiries: return True
+        item = self._itemsByID.get(item_id)
+        return context.purchases.get(item_id, 0) > 0 and (item is None or item._expiry is None)
+
+    # Builds a snapshot of the given members shop state. This should be used whenever the data
+    # of multiple items is needed for the same member so their state is only read once.
+    def getMemberContext(self, member_id: int, economy_users: Optional[EconomyUserCache] = None) -> MemberShopContext:
+        return MemberShopContext(self.bot, member_id, economy_users=economy_users)
+
+    # Builds the snapshots of many members at once, reading all of their state in bulk.
+    def getMemberContexts(self, member_ids: list) -> dict:
+        member_ids = [int(member_id) for member_id in member_ids]
+        state = self._state.getMany([(kind, member_id) for member_id in member_ids for kind in ["purchases", "expiries"]])
+        return {member_id: MemberShopContext(self.bot, member_id, state[("purchases", member_id)] or {}, state[("expiries", member_id)] or {}) for member_id in member_ids}
+
+    # These are used to get and set the members shop state. All reads and writes of the shop state
+    # should go through these so that they go through the write-behind buffer. The dictionaries
+    # returned are copies, so they can be modified and then set again.
+    def getMemberPurchases(self, member_id: int) -> dict:
+        return dict(self._state.get(("purchases", int(member_id))) or {})
+
+    def setMemberPurchases(self, member_id: int, purchases: dict) -> None:
+        self._state.set(("purchases", int(member_id)), dict(purchases))
+        self._memberStateVersions[int(member_id)] = self._memberStateVersions.get(int(member_id), 0) + 1
+
+    def getMemberExpiries(self, member_id: int) -> dict:
+        return dict(self._state.get(("expiries", int(member_id))) or {})
+
+    def setMemberExpiries(self, member_id: int, expiries: dict) -> None:
+        self._state.set(("expiries", int(member_id)), dict(expiries))
+        self._memberStateVersions[int(member_id)] = self._memberStateVersions.get(int(member_id), 0) + 1
+
+        # Update the active item index with any items that have been added or removed.
+        if self._activeIndexLoaded:
+            activeItems = set(self._activeItems.get(int(member_id), set()))
+            for item_id in activeItems - set(expiries): self._setItemActive(int(member_id), item_id, False)
+            for item_id in set(expiries) - activeItems: self._setItemActive(int(member_id), item_id, True)
+
+    # Writes any pending shop state changes to the shop storage.
+    def flushState(self) -> None:
+        self._state.flush()
+
+    # Gets every expiry that is due before the given timestamp as (expires_at, member_id, item_id),
+    # ordered by when they expire.
+    def getExpiriesBefore(self, timestamp: int) -> list:
+        self.flushState()
+        return self._storage.getExpiriesBefore(timestamp)
+
+    # Gets every member that currently has any of the given item IDs active (not yet expired), as
+    # member_id -> [item_id, ...].
+    def getMembersWithActiveItems(self, item_ids: list) -> dict:
+        self.flushState()
+        return self._storage.getMembersWithActiveItems(item_ids)
+
+    # Gets the purchase lock of the given member. Anything that checks and then modifies a members
+    # shop state across an await should hold this lock so it cannot interleave with a purchase.
+    def getMemberLock(self, member_id: int) -> asyncio.Lock:
+        lock = self._memberLocks.get(int(member_id))
+        if lock is None:
+            lock = asyncio.Lock()
+            self._memberLocks[int(member_id)] = lock
+        return lock
+
+    # Attempts to make the given member_id purchase all of the given item IDs, which may contain the same item
+    # multiple times. Every item is checked against a single snapshot of the members state and the total is
+    # taken in a single transaction. If atomic is set then nothing is purchased unless every item can be, else
+    # each item that can be purchased is. The values returned are whether every item was purchased, and a
+    # list with the success and the reason of failure for each of the given item IDs in order. The economyUser
+    # cache of the request can be given so the economyUser is not fetched again, otherwise a new one is used.
+    async def purchaseItems(self, member_id: int, item_ids: list, atomic: bool = True, economy_users: Optional[EconomyUserCache] = None) -> Tuple[bool, list]:
+        if economy_users is None: economy_users = EconomyUserCache(self.bot)
+        results = [{"item_id": item_id, "success": False, "reason": None} for item_id in item_ids]
+        purchasedItems = []; phases = PhaseTimer(self._purchasePhaseSeconds)
+
+        # Everything from the checks up to committing the state is done while holding the members purchase
+        # lock. This stops concurrent purchases by the same member (such as double clicking) from both passing
+        # the checks before either has been committed. Purchases by different members still run in parallel.
+        async with self.getMemberLock(member_id):
+            phases.mark("lock")
+
+            # First, we should get a reference to the given member's economyUser. This allows us to then check
+            # the users balance to ensure that they can actually afford the items currently.
+            ecoUser = await economy_users.getUser(member_id)
+            phases.mark("economy")
+            if ecoUser is None:
+                for result in results: result["reason"] = "Failed to find member in Discord Server."
+                self._purchases.inc("failure")
+                return False, results
+
+            # The context is built after the economyUser so there is no await between reading the members state
+            # and committing it, meaning the expiry task cannot modify the state in between.
+            context = self.getMemberContext(member_id, economy_users)
+            balance = int(ecoUser); total = 0
+            context.balance = balance
+
+            # Next, we check each item is available to the member and affordable. Each accepted item is applied
+            # to the context straight away, so later items in the cart see its limit, expiry and any exclusions.
+            for result in results:
+                item = self.getLoadedItem(result["item_id"])
+                if item is None: result["reason"] = "Unknown item ID."; continue
+
+                itemData = item.getData(member_id, context)
+                if not itemData["available"]: result["reason"] = "Item is unavailable."; continue
+                if total + itemData["price"] > balance: result["reason"] = "Member cannot afford item."; continue
+
+                total += itemData["price"]; result["success"] = True
+                item._applyPurchase(context)
+                purchasedItems.append((item, itemData))
+
+            phases.mark("checks")
+
+            # If the purchase is atomic then a single failure cancels the whole purchase. The context is simply
+            # discarded since nothing has been committed yet.
+            if atomic and len(purchasedItems) != len(results):
+                for result in results:
+                    if result["success"]: result["success"] = False; result["reason"] = "Another item could not be purchased."
+                self._purchases.inc("failure")
+                return False, results
+
+            if len(purchasedItems) == 0: self._purchases.inc("failure"); return False, results
+
+            # Finally, we actually complete the transaction and then commit the purchase counters and expiries
+            # from the context to the members state for the limiter and expiry systems to work correctly.
+            ecoUser.transaction(-total, "Purchased " + ", ".join(["'" + itemData["title"] + "'" for item, itemData in purchasedItems]) + " from shop.")
+            self.setMemberPurchases(member_id, context.purchases)
+
+            expiringItems = [item for item, itemData in purchasedItems if item._expiry is not None]
+            if len(expiringItems) > 0:
+                self.setMemberExpiries(member_id, context.expiries)
+                for item in expiringItems: self.scheduleExpiry(member_id, item.id, context.expiries[item.id])
+
+            phases.mark("commit")
+
+        # Then, queue the purchased event on each item with the given user, gathered from the economyUser's internal
+        # userObject reference, so the item can execute any callbacks such as sending a message to the user etc. These
+        # are run by the side effect workers so the purchase does not wait on any Discord requests. The context is
+        # passed along so the callbacks can use the members state and economyUser without fetching them again.
+        for item, itemData in purchasedItems:
+            self.queueEvent(item, "purchased", ecoUser.userObject, item, context=context)
+
+        self._purchases.inc("success" if len(purchasedItems) == len(results) else "partial")
+        return len(purchasedItems) == len(results), results
+
+    # Records an invocation of an item event callback in the metrics, and logs it if it was slow. The
+    # module of the callback is named so the item file responsible can be found.
+    def _recordEvent(self, item: Item, event: str, callback: Callable, duration: float, failed: bool) -> None:
+        self._eventSeconds.observe(duration, event, item.id)
+        if failed: self._eventErrors.inc(event, item.id)
+
+        if self._slowCallbackThreshold is not None and duration >= self._slowCallbackThreshold:
+            callbackName = str(getattr(callback, "__module__", None)) + "." + str(getattr(callback, "__qualname__", callback))
+            self.bot.log("The '" + event + "' callback '" + callbackName + "' of item '" + str(item.id) + "' took " + str(round(duration, 3)) + "s.")
+
+    def getCategoriesForMemberID(self, member_id: int) -> dict:
+        context = self.getMemberContext(member_id); categories = {}
+        available = set(self.getAvailableItemIDs(member_id, context))
+        for category in self._itemsByCategory:
+            categories[category] = []
+            for item in self._itemsByCategory[category]:
+                itemData = item.getStaticData()
+                itemData.update(item.getDynamicData(context))
+                itemData["available"] = item.id in available
+                categories[category].append(itemData)
         return categories
 
     def createItem(
@@ -237,44 +1092,166 @@ class shopManager():
             "available": available
         })
 
-    def addItem(self, item: Item) -> None:
+    # Adds the item to the shop. Item IDs must be unique since they are used to reference the
+    # item in purchases and in the members state, so an item with an already existing ID is
+    # rejected. The value returned determines if the item was added or not.
+    def addItem(self, item: Item) -> bool:
+
+        # If an item file is being loaded then the item is only added once the whole file has been set
+        # up. The file is allowed to reuse the IDs of the items it registered before it was reloaded.
+        if self._loadingFile is not None:
+            previousItemIDs = [previousItem.id for previousItem in self._itemFiles.get(self._loadingFile["filepath"], {}).get("items", [])]
+            if (item.id in self._itemsByID and item.id not in previousItemIDs) or item.id in [loadingItem.id for loadingItem in self._loadingFile["items"]]:
+                self.bot.log("Cannot add item '" + str(item.id) + "' to the shop since an item with the same ID already exists.", error=True)
+                return False
+
+            self._loadingFile["items"].append(item)
+            return True
+
+        if item.id in self._itemsByID:
+            self.bot.log("Cannot add item '" + str(item.id) + "' to the shop since an item with the same ID already exists.", error=True)
+            return False
+
+        item._attachColumns(self._catalogColumns)
         self._allItems.append(item)
+        self._itemsByID[item.id] = item
+        if item.category not in self._itemsByCategory: self._itemsByCategory[item.category] = []
+        self._itemsByCategory[item.category].append(item)
+
+        # If the item has a group, any members that already have the item active are added to
+        # the active group index.
+        if item.group is not None:
+            if item.group not in self._itemsByGroup: self._itemsByGroup[item.group] = []
+            self._itemsByGroup[item.group].append(item)
+            for member_id in self._activeByItem.get(item.id, set()):
+                self._activeByGroup.setdefault(item.group, {}).setdefault(member_id, set()).add(item.id)
+
+        self.invalidateCatalog()
+        return True
+
+    # Gets all of the items in the given group.
+    def getGroupItems(self, group: str) -> list:
+        return list(self._itemsByGroup.get(group, []))
+
+    # Gets the item IDs of the given group that the member currently has active. If a context is given
+    # then its expiries are used instead of the index, which includes any changes made to the context
+    # that have not been committed yet (such as earlier items in a cart).
+    def getActiveGroupItems(self, member_id: int, group: str, context: Optional[MemberShopContext] = None) -> set:
+        if context is None and self._activeIndexLoaded: return set(self._activeByGroup.get(group, {}).get(int(member_id), set()))
+
+        expiries = context.expiries if context is not None else self.getMemberExpiries(member_id)
+        return {item_id for item_id in expiries if item_id in self._itemsByID and self._itemsByID[item_id].group == group}
+
+    def hasActiveGroupItem(self, member_id: int, group: str, context: Optional[MemberShopContext] = None) -> bool:
+        if context is None and self._activeIndexLoaded: return len(self._activeByGroup.get(group, {}).get(int(member_id), ())) > 0
+        return len(self.getActiveGroupItems(member_id, group, context)) > 0
+
+    # Adds or removes a single active item of a member from the active item index.
+    def _setItemActive(self, member_id: int, item_id: str, active: bool) -> None:
+        item = self._itemsByID.get(item_id)
+        group = None if item is None else item.group
+
+        if active:
+            self._activeItems.setdefault(member_id, set()).add(item_id)
+            self._activeByItem.setdefault(item_id, set()).add(member_id)
+            if group is not None: self._activeByGroup.setdefault(group, {}).setdefault(member_id, set()).add(item_id)
+            return
+
+        # When removing, any sets that are left empty are removed so the index only holds members
+        # that currently have active items.
+        for index, key, value in [(self._activeItems, member_id, item_id), (self._activeByItem, item_id, member_id)]:
+            index.get(key, set()).discard(value)
+            if key in index and len(index[key]) == 0: del index[key]
+
+        if group is not None and group in self._activeByGroup:
+            self._activeByGroup[group].get(member_id, set()).discard(item_id)
+            if len(self._activeByGroup[group].get(member_id, ())) == 0: self._activeByGroup[group].pop(member_id, None)
 
     def getItemFromItemID(self, item_id: str) -> Optional[Item]:
-        for item in self._allItems:
-            if item.id == item_id: return item
-        return None
+        return self._itemsByID.get(item_id)
+
+    # Takes a request to the given route from the global rate limit of the route. If the request is
+    # allowed then 0 is returned, otherwise the amount of seconds until it would be allowed. This should
+    # be checked before any other limit, so a rejected request never creates a bucket of its own.
+    def checkGlobalRateLimit(self, route: str) -> float:
+        limit = self._globalRateLimits.get(route)
+        if limit is None: return 0
+        return self._rateLimiter.acquire((route, "global"), limit["rate"], limit["burst"])
+
+    # Takes a request to the given route from the rate limits of the member and request code, returning
+    # the same as checkGlobalRateLimit. Each member and request code given has its own bucket, so they
+    # should only be given once they are known to be real, otherwise made up IDs could be used to fill
+    # the rate limiter and evict the buckets of other members. Routes without a configured limit are
+    # never limited.
+    def checkRateLimit(self, route: str, request_code: Optional[str] = None, member_id: Optional[int] = None) -> float:
+        limit = self._rateLimits.get(route)
+        if limit is None: return 0
+
+        for key in [("member", member_id), ("code", request_code)]:
+            if key[1] is None: continue
+            retryAfter = self._rateLimiter.acquire((route,) + key, limit["rate"], limit["burst"])
+            if retryAfter > 0: return retryAfter
+        return 0
 
     def getMemberIDFromRequestCode(self, request_code: str) -> Optional[int]:
-        if request_code not in list(self._requestIDs.keys()): return None
-        return self._requestIDs[request_code]
+        return self._requestCodes.getMemberID(request_code)
 
     def getRequestCodeFromMemberID(self, member_id: int) -> Optional[str]:
-        for requestCode in list(self._requestIDs.keys()):
-            if self._requestIDs[requestCode] == int(member_id): return requestCode
-        return None
+        return self._requestCodes.getCode(int(member_id))
 
     def generateLink(self, member_id: int, just_code: bool = False) -> str:
 
         # Get the members last request code if they have one. If they do not then
-        # generate a random string and add that to the requestIDs pool.
+        # generate a random string and add that to the request code store. When using
+        # signed request codes there are no stored codes, so a new one is always issued.
         requestCode = self.getRequestCodeFromMemberID(int(member_id))
-        if requestCode is None:
+        if requestCode is None and isinstance(self._requestCodes, SignedRequestTokens):
+            requestCode = self._requestCodes.issue(int(member_id))
+
+        elif requestCode is None:
             requestCode = self.bot.utils.helpers.core.randomString(length=50)
-            self._requestIDs[requestCode] = int(member_id)
+            self._requestCodes.add(requestCode, int(member_id))
 
         if just_code: return requestCode
         return self.bot.config.json["plugins"]["webshop"]["shop_link"] + "?id=" + str(requestCode)
 
+    # Resolves a file path from the config, which may be relative to the bot root directory. The
+    # special ':memory:' path is used to keep an SQLite database in memory only.
+    def _getDataPath(self, filepath: Optional[str]) -> Optional[str]:
+        if filepath is None or filepath == ":memory:" or os.path.isabs(filepath): return filepath
+        return os.path.join(self.bot.config.json["rootpath"], filepath)
+
+    # This should be called when the plugin is unloaded, so that any open files are closed.
+    def close(self) -> None:
+        self.flushState()
+        self._storage.close()
+        self._requestCodes.close()
+
+    # Gets the filepaths of every item file in the items directory.
+    def getItemFilepaths(self) -> list:
+        return sorted(glob.glob(self.bot.config.json["rootpath"] + "/plugins/webshop/items/*.py"))
+
+    # Loads the given item file, or reloads it if it has already been loaded. When reloading, the module
+    # is reloaded and set up again, and only once that has succeeded are the items, subtitles, conditions
+    # and hook listeners it previously registered swapped for the new ones. The members state, request
+    # codes and expiries are not touched. If anything fails the previously loaded items are kept.
     def loadFile(self, filepath: str) -> bool:
-        filepath = filepath.replace(
+        modulePath = filepath.replace(
             self.bot.config.json["rootpath"] + "/",
             ""
         )
-        filepath = filepath.replace(".py", "")
-        filepath = ".".join(filepath.split("/"))
+        modulePath = modulePath.replace(".py", "")
+        modulePath = ".".join(modulePath.split("/"))
+        self._itemFileMTimes[filepath] = self._getFileMTime(filepath)
+
+        if filepath in self._itemFiles and modulePath in sys.modules:
+            try: module = importlib.reload(sys.modules[modulePath])
+            except Exception:
+                self.bot.log("Failed to reload the item file '" + filepath + "', so its previous items have been kept:\n" + traceback.format_exc(), error=True)
+                return False
 
-        module = self.bot.utils.helpers.core.doImport(filepath)
+        else:
+            module = self.bot.utils.helpers.core.doImport(modulePath)
 
         # In this case, there was an error trying to actually import the file.
         if not isinstance(module, ModuleType):
@@ -283,51 +1260,369 @@ class shopManager():
         # If the module was successfully imported, try to locate a non-async setup
         # function to pass the bot reference to. This is essentially the entrypoint
         # for the item file to actually construct and submit its item.
-        if inspect.isfunction(getattr(module, "setup")):
-            module.setup(self.bot)
+        registration = {"filepath": filepath, "items": [], "subtitles": {}, "conditions": {}, "hooks": []}
+        if inspect.isfunction(getattr(module, "setup", None)):
+            self._loadingFile = registration
+            try: module.setup(self.bot)
+            except Exception:
+                self.bot.log("Failed to setup the item file '" + filepath + "', so none of its changes have been applied:\n" + traceback.format_exc(), error=True)
+                return False
+            finally: self._loadingFile = None
+
+        self._applyItemFile(filepath, registration)
+        if self._lazyItemLoading:
+            self._itemManifest[filepath] = self._getManifestEntry(filepath, registration)
+            self._itemManifestChanged = True
 
         return True
 
-    # This task continously checks the stateManager for any existing expiries. It then
-    # waits for the expiry time to be met. Once this has happened the 'expired' event
-    # is called on the item with the discord.User.
+    # Loads every item file in the items directory. With lazy item loading, any file that has an up to
+    # date manifest entry is not imported, and its items are instead created from the manifest.
+    def loadItemFiles(self) -> None:
+        if self._lazyItemLoading: self._itemManifest = self._loadItemManifest()
+        for filepath in self.getItemFilepaths():
+            entry = self._itemManifest.get(filepath)
+            if entry is not None and entry["lazy"] and entry["mtime"] == self._getFileMTime(filepath): self._loadFileFromManifest(filepath, entry)
+            else: self.loadFile(filepath)
+
+        self._saveItemManifest()
+
+    # Removes everything that the given item file registered from the shop.
+    def unloadFile(self, filepath: str) -> bool:
+        self._itemFileMTimes.pop(filepath, None)
+        if filepath not in self._itemFiles: return False
+        self._applyItemFile(filepath, None)
+        self._itemManifestChanged = True
+        return True
+
+    # Loads any item files that have been added or modified since they were last loaded, and unloads
+    # any that have been deleted. The filepaths of the files that were changed are returned.
+    def reloadChangedFiles(self) -> list:
+        changedFiles = []
+        for filepath in sorted(set(self._itemFileMTimes) | set(self.getItemFilepaths())):
+            mtime = self._getFileMTime(filepath)
+            if mtime is None:
+                if self.unloadFile(filepath): changedFiles.append(filepath)
+                self._itemFileMTimes.pop(filepath, None)
+
+            elif self._itemFileMTimes.get(filepath) != mtime:
+                if self.loadFile(filepath): changedFiles.append(filepath)
+
+        self._saveItemManifest()
+        return changedFiles
+
+    # Gets the item with the given ID, first loading its item file if the item was created from the
+    # item manifest. This should be used before running any of the items events.
+    def getLoadedItem(self, item_id: str) -> Optional[Item]:
+        item = self._itemsByID.get(item_id)
+        if item is None or item._lazyFilepath is None: return item
+
+        self.loadFile(item._lazyFilepath)
+        self._saveItemManifest()
+        return self._itemsByID.get(item_id)
+
+    # Creates the items of an item file from its manifest entry, without importing the file. The
+    # items are registered to the file, so they are swapped for the real items once it is loaded.
+    def _loadFileFromManifest(self, filepath: str, entry: dict) -> None:
+        registration = {"filepath": filepath, "items": [], "subtitles": dict(entry["subtitles"]), "conditions": {}, "hooks": []}
+        for itemEntry in entry["items"]:
+            item = Item(self.bot, itemEntry["id"], itemEntry["category"], dict(itemEntry["data"]))
+            item._limit = itemEntry["limit"]
+            item._expiry = itemEntry["expiry"]
+            item.group = itemEntry["group"]
+            item._exclusive = itemEntry["exclusive"]
+            item._requiredItems = frozenset(itemEntry["required_items"])
+            item._excludedItems = frozenset(itemEntry["excluded_items"])
+            item._conditions = frozenset(itemEntry["conditions"])
+            item._minBalance = itemEntry["min_balance"]
+            item._lazyFilepath = filepath
+            registration["items"].append(item)
+
+        self._itemFileMTimes[filepath] = entry["mtime"]
+        self._applyItemFile(filepath, registration)
+
+    # Builds the manifest entry of a loaded item file. A file can only be loaded lazily if it does not
+    # register any hook listeners or conditions, and its items only have purchased and expired events
+    # or get_* events that are the same for every member, since those are resolved into the manifest.
+    def _getManifestEntry(self, filepath: str, registration: dict) -> dict:
+        entry = {"mtime": self._itemFileMTimes.get(filepath), "lazy": False, "subtitles": registration["subtitles"], "items": []}
+        if len(registration["hooks"]) > 0 or len(registration["conditions"]) > 0: return entry
+
+        for item in registration["items"]:
+            if len(item._dynamicFields) > 0 or len(item._fieldTTLs) > 0 or len(item._contextCallbacks - {"purchased", "expired"}) > 0: return entry
+            if any(event not in ["purchased", "expired"] and not event.startswith("get_") for event in item._callbacks): return entry
+
+            entry["items"].append({
+                "id": item.id,
+                "category": item.category,
+                "data": {k: item._getStaticField(k) for k in item._getFieldKeys()},
+                "limit": item._limit,
+                "expiry": item._expiry,
+                "group": item.group,
+                "exclusive": item._exclusive,
+                "required_items": sorted(item._requiredItems),
+                "excluded_items": sorted(item._excludedItems),
+                "conditions": sorted(item._conditions),
+                "min_balance": item._minBalance
+            })
+
+        # The entry is only lazy if it can actually be written to the manifest.
+        try: json.dumps(entry)
+        except (TypeError, ValueError): entry["items"] = []; return entry
+        entry["lazy"] = True
+        return entry
+
+    def _loadItemManifest(self) -> dict:
+        if self._itemManifestPath is None or not os.path.isfile(self._itemManifestPath): return {}
+        try:
+            with open(self._itemManifestPath, "r") as manifestFile: return json.load(manifestFile)
+        except (OSError, ValueError):
+            self.bot.log("Failed to read the item manifest, so every item file will be loaded.", error=True)
+            return {}
+
+    # Writes the manifest entries of every item file that is currently loaded, if any have changed.
+    def _saveItemManifest(self) -> None:
+        if not self._lazyItemLoading or not self._itemManifestChanged or self._itemManifestPath is None: return
+        manifest = {filepath: entry for filepath, entry in self._itemManifest.items() if filepath in self._itemFiles}
+        with open(self._itemManifestPath + ".tmp", "w") as manifestFile: json.dump(manifest, manifestFile)
+        os.replace(self._itemManifestPath + ".tmp", self._itemManifestPath)
+        self._itemManifestChanged = False
+
+    def _getFileMTime(self, filepath: str) -> Optional[float]:
+        try: return os.path.getmtime(filepath)
+        except OSError: return None
+
+    # Swaps everything the item file previously registered for the given registration, or removes it if
+    # the registration is None. This is done without awaiting anything, so no request can see the shop
+    # with only part of the file swapped. The new items take the place of the old items in the shop.
+    def _applyItemFile(self, filepath: str, registration: Optional[dict]) -> None:
+        previous = self._itemFiles.pop(filepath, None) or {"items": [], "subtitles": {}, "conditions": {}, "hooks": []}
+        current = registration or {"items": [], "subtitles": {}, "conditions": {}, "hooks": []}
+
+        previousItemIDs = {item.id for item in previous["items"]}
+        position = next((index for index, item in enumerate(self._allItems) if item.id in previousItemIDs), len(self._allItems))
+        remainingItems = [item for item in self._allItems if item.id not in previousItemIDs]
+        self._allItems = remainingItems[:position] + current["items"] + remainingItems[position:]
+        currentItems = {id(item) for item in current["items"]}
+        for item in previous["items"]:
+            if id(item) not in currentItems: item._detachColumns()
+        for item in current["items"]: item._attachColumns(self._catalogColumns)
+        self._rebuildItemIndexes()
+
+        for category in previous["subtitles"]:
+            if category not in current["subtitles"]: self._categorySubtitles.pop(category, None)
+        self._categorySubtitles.update(current["subtitles"])
+
+        for key in previous["conditions"]:
+            if key not in current["conditions"]: self._conditions.pop(key, None)
+        self._conditions.update(current["conditions"])
+
+        for hook, callback in previous["hooks"]:
+            try: self.bot.utils.managers.hookManager.removeListener(hook, callback)
+            except Exception: self.bot.log("Failed to remove the '" + hook + "' hook listener of the item file '" + filepath + "':\n" + traceback.format_exc(), error=True)
+        for hook, callback in current["hooks"]:
+            self.bot.utils.managers.hookManager.addListener(hook, callback)
+
+        if registration is not None: self._itemFiles[filepath] = registration
+        self.invalidateCatalog()
+
+    # Rebuilds the item indexes from the list of items. The active item index is kept, since it is
+    # by item ID, and only the group part of it is rebuilt in case an items group has changed.
+    def _rebuildItemIndexes(self) -> None:
+        self._itemsByID = {}; self._itemsByCategory = {}; self._itemsByGroup = {}; self._activeByGroup = {}
+        for item in self._allItems:
+            self._itemsByID[item.id] = item
+            self._itemsByCategory.setdefault(item.category, []).append(item)
+            if item.group is None: continue
+
+            self._itemsByGroup.setdefault(item.group, []).append(item)
+            for member_id in self._activeByItem.get(item.id, set()):
+                self._activeByGroup.setdefault(item.group, {}).setdefault(member_id, set()).add(item.id)
+
+    # This is used to add an expiry to the expiry queue. It should be called every time an
+    # items expiry is added or modified in the members state so the expiry task knows when it
+    # next has to wake up. Any outdated entries left in the queue are ignored once popped.
+    def scheduleExpiry(self, member_id: int, item_id: str, expires_at: int) -> None:
+        entry = (int(expires_at), int(member_id), item_id)
+        heapq.heappush(self._expiryQueue, entry)
+
+        # If the new entry is now the next expiry due, the expiry task may be sleeping until
+        # a later deadline so we have to wake it up to recalculate how long it should sleep.
+        if self._expiryQueue[0] is entry: self._expiryQueueWakeup.set()
+
+    # This is the only time that every expiry is loaded from the shop storage. Every expiry found
+    # is pushed into the expiry queue and the active item index, after which they are kept up to
+    # date through the scheduleExpiry and setMemberExpiries functions.
+    def _loadExpiryQueue(self) -> None:
+        self.flushState()
+        for expires_at, member_id, item_id in self._storage.getAllExpiries():
+            self._expiryQueue.append((int(expires_at), int(member_id), item_id))
+            self._setItemActive(int(member_id), item_id, True)
+
+        heapq.heapify(self._expiryQueue)
+        self._activeIndexLoaded = True
+
+        now = int(time.time())
+        overdue = sum(1 for expires_at, member_id, item_id in self._expiryQueue if expires_at <= now)
+        if overdue > self._expiryBatchSize: self.bot.log("Catching up on " + str(overdue) + " overdue expiries in batches of " + str(self._expiryBatchSize) + ".")
+
+    # Sleeps until either the timeout has passed or an earlier expiry has been scheduled. A
+    # timeout of None means the task will sleep until something is scheduled.
+    async def _waitForExpiryWakeup(self, timeout: Optional[float]) -> None:
+        self._expiryQueueWakeup.clear()
+        try: await asyncio.wait_for(self._expiryQueueWakeup.wait(), timeout)
+        except asyncio.TimeoutError: pass
+
+    # Expires a batch of popped expiry queue entries, given in the order they were due. The entries are
+    # grouped by member so each members expiries are read and written once for the whole batch, and the
+    # members state is read in bulk. Any entry that no longer matches the members state has been removed
+    # or changed since it was scheduled, so it is ignored. The removals are committed straight away and
+    # the expired events are queued for the expiry workers, so a slow callback never holds up an expiry.
+    async def _expireMemberItems(self, entries: list) -> None:
+        memberEntries = {}
+        for expires_at, member_id, item_id in entries: memberEntries.setdefault(member_id, []).append((item_id, expires_at))
+
+        # Members that are in the middle of a purchase are expired separately once their lock is released,
+        # since the purchase would otherwise overwrite the removal when it commits. This is done in the
+        # background so that a slow purchase does not hold up the rest of the batch.
+        expired = []
+        state = self._state.getMany([("expiries", member_id) for member_id in memberEntries])
+        for member_id, dueItems in memberEntries.items():
+            if not self.getMemberLock(member_id).locked(): expired.extend(self._removeDueExpiries(member_id, dict(state[("expiries", member_id)] or {}), dueItems))
+            else:
+                task = asyncio.ensure_future(self._expireLockedMemberItems(member_id, dueItems))
+                self._lockedExpiryTasks.add(task); task.add_done_callback(self._lockedExpiryTasks.discard)
+
+        for entry in expired: self._expiredQueue.put_nowait(entry)
+
+    async def _expireLockedMemberItems(self, member_id: int, due_items: list) -> None:
+        async with self.getMemberLock(member_id):
+            expired = self._removeDueExpiries(member_id, self.getMemberExpiries(member_id), due_items)
+        for entry in expired: self._expiredQueue.put_nowait(entry)
+
+    # Removes the given (item_id, expires_at) entries from the members expiries if they still match,
+    # writing the expiries back once. The (member_id, item_id) of each removed expiry is returned.
+    def _removeDueExpiries(self, member_id: int, expiries: dict, due_items: list) -> list:
+        expired = [(member_id, item_id) for item_id, expires_at in due_items if expiries.get(item_id) == expires_at]
+        if len(expired) == 0: return expired
+
+        for _, item_id in expired: expiries.pop(item_id, None)
+        self.setMemberExpiries(member_id, expiries)
+        return expired
+
+    # We should get a user refrence for the member and then invoke the expired event on the item. If it
+    # fails it is retried by the side effect workers like any other side effect.
+    async def _dispatchExpired(self, member_id: int, item_id: str) -> None:
+        user = self.bot.get_user(member_id)
+        if user is None:
+            self.bot.log("The user ID '" + str(member_id) + "' has a finished expiry for item '" + str(item_id) + "' however we cannot get a user object. This means we cannot call the expiry function on the given member ID.", error=True)
+            return
+
+        item = self.getLoadedItem(item_id)
+        if item is None: return
+        await self._runSideEffect(item, "expired", (user, item), None, 0)
+
+    # Each expiry worker runs the expired events of removed expiries one at a time.
+    async def _expiry_worker(self) -> None:
+        while True:
+            member_id, item_id = await self._expiredQueue.get()
+            try: await self._dispatchExpired(member_id, item_id)
+            except Exception: traceback.print_exc()
+            finally: self._expiredQueue.task_done()
+
+    # Queues an event to be invoked on the item by the side effect workers. This is used for events
+    # such as purchased and expired whose callbacks do not need to finish before we can respond. The
+    # context is passed on to any callback that accepts it.
+    def queueEvent(self, item: Item, event: str, *args, context: Optional[MemberShopContext] = None) -> None:
+        self._sideEffectQueue.put_nowait((item, event, args, context, 0))
+
+    # Each worker invokes queued events one at a time. If an event raises an exception it is queued
+    # again after a delay that doubles with each attempt, so the worker can carry on with other events
+    # in the meantime. Once an event has used all of its retries it is moved to the dead letters.
+    async def _side_effect_worker(self) -> None:
+        while True:
+            item, event, args, context, attempt = await self._sideEffectQueue.get()
+            try: await self._runSideEffect(item, event, args, context, attempt)
+            finally: self._sideEffectQueue.task_done()
+
+    # Invokes a side effect, giving up on it once the side effect timeout has passed. An event that
+    # times out is not retried, as it could have been cancelled part way through (such as after the
+    # role was given but before the DM was sent) and running it again could repeat what it already did.
+    async def _runSideEffect(self, item: Item, event: str, args: tuple, context: Optional[MemberShopContext], attempt: int) -> None:
+        try:
+            await asyncio.wait_for(item._asyncInvokeEvent(event, *args, context=context), self._sideEffectTimeout)
+
+        except asyncio.TimeoutError:
+            self._deadLetters.append((time.time(), item.id, event, args, traceback.format_exc()))
+            self.bot.log("The '" + event + "' event for item '" + str(item.id) + "' timed out after " + str(self._sideEffectTimeout) + " seconds and has been dropped.", error=True)
+
+        except Exception:
+            if attempt < self._sideEffectRetries:
+                asyncio.get_running_loop().call_later(self._sideEffectRetryDelay * (2 ** attempt), self._sideEffectQueue.put_nowait, (item, event, args, context, attempt + 1))
+
+            else:
+                self._deadLetters.append((time.time(), item.id, event, args, traceback.format_exc()))
+                self.bot.log("The '" + event + "' event for item '" + str(item.id) + "' failed after " + str(attempt + 1) + " attempts and has been dropped:\n" + traceback.format_exc(), error=True)
+
+    # This task periodically flushes the write-behind buffer, so that shop state changes are not
+    # held back for longer than the flush interval.
+    async def _state_flush_task(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self._stateFlushInterval)
+                self.flushState()
+
+            except asyncio.CancelledError:
+                self.flushState()
+                raise
+
+            except Exception:
+                traceback.print_exc()
+
+    # This task periodically reloads any item files that have changed, so items can be edited without
+    # reloading the whole plugin.
+    async def _item_reload_task(self) -> None:
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await asyncio.sleep(self._itemReloadInterval)
+                changedFiles = self.reloadChangedFiles()
+                if len(changedFiles) > 0: self.bot.log("Reloaded the shop item files: " + ", ".join(changedFiles))
+
+            except Exception:
+                traceback.print_exc()
+
+    # This task sleeps until the next expiry in the expiry queue is due. Once this has happened
+    # the 'expired' event is called on the item with the discord.User. When there are no expiries
+    # the task sleeps until one is scheduled, so it costs nothing while idle.
     async def _item_expiry_task(self) -> None:
         await self.bot.wait_until_ready()
+        self._loadExpiryQueue()
 
         while True:
             try:
-                for k in self.bot.utils.managers.stateManager.currentStateData:
-                    if not k.startswith("shop-expiry-"): continue
-                    member_id = int(k.replace("shop-expiry-", "")); user = None
-
-                    # Here we get each item ID in the users expiry dictionary, because the
-                    # member could hypothetically have multiple items on expiry cooldown.
-                    itemsExpiryData = dict(self.bot.utils.managers.stateManager.currentStateData[k][0])
-
-                    for item_id in self.bot.utils.managers.stateManager.currentStateData[k][0]:
-                        if int(time.time()) >= self.bot.utils.managers.stateManager.currentStateData[k][0][item_id]:
-                            
-                            # In this case the given item_id has expired for the member. We should get a user refrence
-                            # for the member and then call the expired event on the item. We also check to see if the user
-                            # is already not none, which would indicate that multiple items have expired together.
-                            if user is None:
-                                user = self.bot.get_user(member_id)
-                            
-                            if user is not None:
-                                item = self.getItemFromItemID(item_id)
-                                if item is not None: await item._asyncInvokeEvent("expired", user, item)
-
-                            else:
-                                self.bot.log("The user ID '" + str(member_id) + "' has a finished expiry for item '" + str(item_id) + "' however we cannot get a user object. This means we cannot call the expiry function on the given member ID.", error=True)
-
-                            # Finally, we remove the item_id from the users stateData.
-                            itemsExpiryData.pop(item_id, None)
-                    
-                    # If the items expiry data was modified, we should set the new value.
-                    if itemsExpiryData != self.bot.utils.managers.stateManager.currentStateData[k][0]:
-                        self.bot.utils.managers.stateManager.set(k, itemsExpiryData)
-                        
-                await asyncio.sleep(1)
+                if len(self._expiryQueue) == 0:
+                    await self._waitForExpiryWakeup(None)
+                    continue
+
+                # If the next expiry is not yet due, sleep until it is. We then loop back around
+                # since an earlier expiry could have been scheduled while we were sleeping.
+                expires_at, member_id, item_id = self._expiryQueue[0]
+                if int(time.time()) < expires_at:
+                    await self._waitForExpiryWakeup(expires_at - time.time())
+                    continue
+
+                # Every due expiry is taken from the queue in the order they were due, up to the batch
+                # size. After a long downtime this streams through the backlog a batch at a time, giving
+                # the rest of the bot a chance to run between each batch.
+                now = int(time.time()); batch = []
+                while len(self._expiryQueue) > 0 and self._expiryQueue[0][0] <= now and len(batch) < self._expiryBatchSize:
+                    batch.append(heapq.heappop(self._expiryQueue))
+
+                with Timer(self._expiryTickSeconds):
+                    await self._expireMemberItems(batch)
+                self._expiries.inc(amount=len(batch))
+                await asyncio.sleep(0)
 
             except Exception:
                 traceback.print_exc()
@@ -0,0 +1,183 @@
+import sqlite3
+from typing import Any, Callable, Optional, Tuple
+
+# The shop storage holds the members shop state, which is their purchase counters and their item
+# expiries. The state is read and written per member as (kind, member_id) keys, where the kind is
+# either "purchases" or "expiries" and the value is a dictionary keyed by item ID. There are two
+# storage backends:
+#   - SQLiteStorage (the default) keeps the state in indexed tables, so queries such as finding
+#     every expiry due before a given time do not need to look at every member.
+#   - StateManagerStorage keeps the state in the bot stateManager using the original per member
+#     'shop-purchases-<id>' and 'shop-expiry-<id>' keys.
+
+class StateManagerStorage():
+    def __init__(self, bot):
+        self.bot = bot
+
+    def get(self, key: Tuple[str, int]) -> Optional[dict]:
+        return self.bot.utils.managers.stateManager.get(self._getStateKey(key))
+
+    def getMany(self, keys: list) -> dict:
+        return {key: self.get(key) for key in keys}
+
+    def writeBatch(self, changes: dict) -> None:
+        for key, value in changes.items():
+            self.bot.utils.managers.stateManager.set(self._getStateKey(key), value)
+
+    # Gets every expiry of every member as (expires_at, member_id, item_id). Since the state is
+    # stored per member, this has to scan every key in the stateManager.
+    def getAllExpiries(self) -> list:
+        expiries = []
+        for k in list(self.bot.utils.managers.stateManager.currentStateData.keys()):
+            if not k.startswith("shop-expiry-"): continue
+            member_id = int(k.replace("shop-expiry-", ""))
+
+            userExpiry = self.bot.utils.managers.stateManager.get(k) or {}
+            for item_id in list(userExpiry.keys()): expiries.append((int(userExpiry[item_id]), member_id, item_id))
+        return expiries
+
+    def getExpiriesBefore(self, timestamp: int) -> list:
+        return sorted([expiry for expiry in self.getAllExpiries() if expiry[0] < timestamp])
+
+    def getMembersWithActiveItems(self, item_ids: list) -> dict:
+        members = {}
+        for expires_at, member_id, item_id in self.getAllExpiries():
+            if item_id in item_ids: members.setdefault(member_id, []).append(item_id)
+        return members
+
+    def close(self) -> None:
+        pass
+
+    def _getStateKey(self, key: Tuple[str, int]) -> str:
+        return ("shop-purchases-" if key[0] == "purchases" else "shop-expiry-") + str(key[1])
+
+class SQLiteStorage():
+    def __init__(self, filepath: str):
+        self.filepath: str = filepath
+        self._connection = sqlite3.connect(filepath, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS purchases (member_id INTEGER NOT NULL, item_id TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (member_id, item_id));
+            CREATE TABLE IF NOT EXISTS expiries (member_id INTEGER NOT NULL, item_id TEXT NOT NULL, expires_at INTEGER NOT NULL, PRIMARY KEY (member_id, item_id));
+            CREATE INDEX IF NOT EXISTS expiries_expires_at ON expiries (expires_at);
+            CREATE INDEX IF NOT EXISTS expiries_item_id ON expiries (item_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def get(self, key: Tuple[str, int]) -> Optional[dict]:
+        if key[0] == "purchases": rows = self._connection.execute("SELECT item_id, count FROM purchases WHERE member_id = ?", (key[1],))
+        else: rows = self._connection.execute("SELECT item_id, expires_at FROM expiries WHERE member_id = ?", (key[1],))
+        return {item_id: value for item_id, value in rows}
+
+    # Gets the state of many keys at once, using a single query per kind for each chunk of members
+    # rather than a query per key. Keys without any rows are given an empty dictionary.
+    def getMany(self, keys: list) -> dict:
+        values = {key: {} for key in keys}
+        for kind, table, column in [("purchases", "purchases", "count"), ("expiries", "expiries", "expires_at")]:
+            member_ids = [key[1] for key in keys if key[0] == kind]
+            for index in range(0, len(member_ids), 500):
+                chunk = member_ids[index:index + 500]
+                rows = self._connection.execute("SELECT member_id, item_id, " + column + " FROM " + table + " WHERE member_id IN (" + ", ".join(["?"] * len(chunk)) + ")", chunk)
+                for member_id, item_id, value in rows: values[(kind, member_id)][item_id] = value
+        return values
+
+    # Every change in the batch replaces all of the rows of that kind for the member, and the whole
+    # batch is written in a single transaction.
+    def writeBatch(self, changes: dict) -> None:
+        with self._transaction():
+            for key, value in changes.items():
+                table, column = ("purchases", "count") if key[0] == "purchases" else ("expiries", "expires_at")
+                self._connection.execute("DELETE FROM " + table + " WHERE member_id = ?", (key[1],))
+                self._connection.executemany("INSERT INTO " + table + " (member_id, item_id, " + column + ") VALUES (?, ?, ?)", [(key[1], item_id, int(v)) for item_id, v in value.items()])
+
+    def getAllExpiries(self) -> list:
+        return list(self._connection.execute("SELECT expires_at, member_id, item_id FROM expiries"))
+
+    def getExpiriesBefore(self, timestamp: int) -> list:
+        return list(self._connection.execute("SELECT expires_at, member_id, item_id FROM expiries WHERE expires_at < ? ORDER BY expires_at", (timestamp,)))
+
+    def getMembersWithActiveItems(self, item_ids: list) -> dict:
+        members = {}
+        rows = self._connection.execute("SELECT member_id, item_id FROM expiries WHERE item_id IN (" + ", ".join(["?"] * len(item_ids)) + ")", list(item_ids))
+        for member_id, item_id in rows: members.setdefault(member_id, []).append(item_id)
+        return members
+
+    # Copies any shop state from the stateManager into the database. This only ever happens once,
+    # which is recorded in the meta table, so state written by older versions of the shop is kept.
+    def migrateFromStateManager(self, bot) -> int:
+        if self._connection.execute("SELECT value FROM meta WHERE key = 'migrated_state_manager'").fetchone() is not None: return 0
+
+        changes = {}
+        for k in list(bot.utils.managers.stateManager.currentStateData.keys()):
+            if k.startswith("shop-purchases-"): key = ("purchases", int(k.replace("shop-purchases-", "")))
+            elif k.startswith("shop-expiry-"): key = ("expiries", int(k.replace("shop-expiry-", "")))
+            else: continue
+            changes[key] = bot.utils.managers.stateManager.get(k) or {}
+
+        self.writeBatch(changes)
+        self._connection.execute("INSERT INTO meta (key, value) VALUES ('migrated_state_manager', ?)", (str(len(changes)),))
+        return len(changes)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._connection)
+
+class _SQLiteTransaction():
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self) -> None:
+        self.connection.execute("BEGIN")
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+# The write-behind buffer sits between the shop and the storage of the members shop state. Writes
+# are held in the buffer and coalesced per key, so a member that makes many purchases in a short
+# time only results in a single write. The buffer is flushed on an interval by the shopManager, once
+# it holds too many pending writes, and when the plugin is unloaded. Reads always check the buffer
+# first so the shop never sees an outdated value.
+class WriteBehindBuffer():
+    def __init__(self, read: Callable[[Any], Any], write_batch: Callable[[dict], None], max_pending: int = 500, read_many: Optional[Callable[[list], dict]] = None):
+        self._read: Callable[[Any], Any] = read
+        self._readMany: Optional[Callable[[list], dict]] = read_many
+        self._writeBatch: Callable[[dict], None] = write_batch
+        self.maxPending: int = max_pending
+        self._pending: dict = {}
+
+    def get(self, key: Any) -> Any:
+        if key in self._pending: return self._pending[key]
+        return self._read(key)
+
+    # Gets the values of many keys at once. Only the keys that are not pending are read from the
+    # storage, in a single call if the storage supports it.
+    def getMany(self, keys: list) -> dict:
+        missingKeys = [key for key in keys if key not in self._pending]
+        if self._readMany is not None: values = self._readMany(missingKeys)
+        else: values = {key: self._read(key) for key in missingKeys}
+        for key in keys:
+            if key in self._pending: values[key] = self._pending[key]
+        return values
+
+    def set(self, key: Any, value: Any) -> None:
+        self._pending[key] = value
+        if len(self._pending) >= self.maxPending: self.flush()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    # Writes every pending value to the storage in a single batch. The pending writes are swapped
+    # out first so any writes made while flushing are kept for the next flush.
+    def flush(self) -> None:
+        if len(self._pending) == 0: return
+        pending = self._pending; self._pending = {}
+        try: self._writeBatch(pending)
+        except Exception:
+
+            # If the batch could not be written then the writes are put back, unless they have
+            # since been replaced by a newer write, so they are attempted again on the next flush.
+            for key, value in pending.items(): self._pending.setdefault(key, value)
+            raise
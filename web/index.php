@@ -147,6 +147,20 @@ if (!$response["success"]) { destroyIncorrectID($response); raise((array_key_exi
 // Finally, we move inside of the data key which actually contains the important data.
 $response = $response["data"];
 
+// The API sends the catalog items without any member specific data, which is instead sent
+// alongside as the list of available item IDs and any per member item values. Here we merge
+// those back into each of the items so they can be rendered as before.
+$availableItems = array_flip($response["available"]);
+foreach ($response["categories"] as $categoryName => $categoryItems) {
+    foreach ($categoryItems as $index => $itemData) {
+        if (array_key_exists($itemData["id"], $response["item_overrides"])) {
+            $itemData = array_merge($itemData, $response["item_overrides"][$itemData["id"]]);
+        }
+        $itemData["available"] = array_key_exists($itemData["id"], $availableItems);
+        $response["categories"][$categoryName][$index] = $itemData;
+    }
+}
+
 // This model contains the default values which are added to all items if they
 // lack the given key. This ensures that each item can be correctly parsed by the
 // HTML handlers below.